@@ -1,206 +1,480 @@
+import time
+_import_started = time.perf_counter()
+
 import os
+import json
+import math
 import shutil
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify
+import threading
+import uuid
+from flask import Flask, Response, render_template, request, redirect, url_for, send_from_directory, jsonify
 from werkzeug.utils import secure_filename
-import requests
-import demucs.separate
-from utils.transcribe import transcribe_to_midi
-from utils.midi_to_pdf import convert_midi_to_pdf
-from utils.drum_transcribe import DrumBeatExtractor
-from utils.midifren_wrapper import run_midifren_drums
+from utils.jobs import JobManager, QueueFull
+from utils.metrics import METRICS, Trace, span, tracing
+from utils.lyrics import LyricsService
+from utils.models import get_demucs, set_thread_limits, warm_models
+from utils.profiles import PROFILES, Profile, add_profile, get_profile
+from utils.scheduler import default_cpu_count, get_scheduler, partition_threads
+from utils.midi_to_pdf import get_render_service
+from utils.cache import ResultCache, derived_key, result_key
+from utils.uploads import UploadRequest
+from utils.archive import stream_zip
+from utils.pipeline import (process_song, processing_params, retranscribe_result, retranscribable_stems, midi_name,
+                            ALL_STEMS, META_FILE, DRUM_SENSITIVITY, RETRANSCRIBE_DEFAULTS)
 
 UPLOAD_FOLDER = 'static/uploads'
 OUTPUT_BASE = 'static/separated'
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'flac', 'ogg'}
 
 app = Flask(__name__)
+# uploads are streamed to disk and hashed while they arrive, see utils/uploads.py
+app.request_class = UploadRequest
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# larger request bodies are refused with 413, without reading them; the default takes about 100 minutes
+# of 16-bit 44.1 kHz stereo WAV, since recordings over STREAMING_MIN_SECONDS are processed in chunks
+app.config['MAX_UPLOAD_MB'] = float(os.environ.get('MAX_UPLOAD_MB', 1024))
+app.config['MAX_CONTENT_LENGTH'] = int(app.config['MAX_UPLOAD_MB'] * 1024 * 1024)
+# browser cache lifetime of downloads; a result id always names the same files
+app.config['DOWNLOAD_MAX_AGE'] = int(os.environ.get('DOWNLOAD_MAX_AGE', 24 * 3600))
 app.config['OUTPUT_BASE'] = OUTPUT_BASE
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['CACHE_MAX_BYTES'] = int(os.environ.get('CACHE_MAX_BYTES', 5 * 1024 ** 3))
+app.config['CACHE_MAX_AGE'] = float(os.environ.get('CACHE_MAX_AGE', 7 * 24 * 3600))
+app.config['WARM_MODELS'] = os.environ.get('WARM_MODELS', '0') == '1'
+# 'memory' hands separated stems straight to transcription, 'disk' re-reads the encoded files
+app.config['STEM_HANDOFF'] = os.environ.get('STEM_HANDOFF', 'memory')
+app.config['STEM_FORMAT'] = os.environ.get('STEM_FORMAT', 'mp3')
+# recordings longer than this are separated and transcribed in chunks within MAX_CHUNK_MEMORY_MB
+app.config['STREAMING_MIN_SECONDS'] = float(os.environ.get('STREAMING_MIN_SECONDS', 600))
+app.config['MAX_CHUNK_MEMORY_MB'] = float(os.environ.get('MAX_CHUNK_MEMORY_MB', 1024))
+app.config['RENDER_PDF'] = os.environ.get('RENDER_PDF', '1') == '1'
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', 1))
+app.config['LYRICS_DEADLINE'] = float(os.environ.get('LYRICS_DEADLINE', 12))
+# keep drum onset analysis and basic-pitch posteriors with each result for /retranscribe
+app.config['KEEP_ANALYSIS'] = os.environ.get('KEEP_ANALYSIS', '1') == '1'
+# quality/speed profile for uploads that do not pick one (quality, balanced, fast)
+app.config['PROFILE'] = os.environ.get('PROFILE', 'balanced')
+# an int8-quantized basic-pitch TFLite export adds a "fast-int8" profile
+app.config['BASIC_PITCH_INT8_MODEL'] = os.environ.get('BASIC_PITCH_INT8_MODEL')
+# with several server processes (gunicorn.conf.py) job status is shared through files here
+app.config['JOB_STATE_DIR'] = os.environ.get('JOB_STATE_DIR', '')
+# preview length when an upload gives a start time but no end
+app.config['PREVIEW_SECONDS'] = float(os.environ.get('PREVIEW_SECONDS', 30))
+# concurrent Demucs runs / stem transcriptions per host, and how many jobs may wait before uploads get a 429
+app.config['SEPARATE_SLOTS'] = int(os.environ.get('SEPARATE_SLOTS', 1))
+app.config['TRANSCRIBE_SLOTS'] = int(os.environ.get('TRANSCRIBE_SLOTS', 1))
+app.config['DRUM_SLOTS'] = int(os.environ.get('DRUM_SLOTS', 1))
+# stem branches (transcription, then PDF) of one job that may run at the same time
+app.config['STEM_WORKERS'] = int(os.environ.get('STEM_WORKERS', 2))
+app.config['MAX_PENDING_JOBS'] = int(os.environ.get('MAX_PENDING_JOBS', 8))
+_torch_threads, _tf_threads = partition_threads(default_cpu_count(), app.config['SEPARATE_SLOTS'],
+                                                app.config['TRANSCRIBE_SLOTS'])
+app.config['TORCH_THREADS'] = int(os.environ.get('TORCH_THREADS', _torch_threads))
+app.config['TF_THREADS'] = int(os.environ.get('TF_THREADS', _tf_threads))
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_BASE, exist_ok=True)
 
+jobs = JobManager(max_workers=app.config['JOB_WORKERS'], max_pending=app.config['MAX_PENDING_JOBS'],
+                  state_dir=app.config['JOB_STATE_DIR'] or None)
+get_scheduler(app.config['SEPARATE_SLOTS'], app.config['TRANSCRIBE_SLOTS'], app.config['DRUM_SLOTS'])
+set_thread_limits(app.config['TORCH_THREADS'], app.config['TF_THREADS'])
+if app.config['BASIC_PITCH_INT8_MODEL']:
+    add_profile(Profile("fast-int8", overlap=0.1, basic_pitch=app.config['BASIC_PITCH_INT8_MODEL']))
+default_profile = get_profile(app.config['PROFILE'])
+lyrics_service = LyricsService(deadline=app.config['LYRICS_DEADLINE'])
+cache = ResultCache(OUTPUT_BASE, max_bytes=app.config['CACHE_MAX_BYTES'], max_age=app.config['CACHE_MAX_AGE'])
+# cache key -> job currently producing that result, so identical uploads share one run
+inflight = {}
+inflight_lock = threading.Lock()
+
+def warm_default_models():
+    """Load the default profile's models; the ML libraries are only imported here."""
+    try:
+        basic_pitch_path = default_profile.basic_pitch_path()
+    except Exception as e:
+        print(f"[models] warm-up failed: {e}")
+        return
+    warm_models(default_profile.demucs_model, basic_pitch_path)
+
+def preload_models():
+    """
+    Load Demucs in this process before it forks (see gunicorn.conf.py), so the
+    workers share its weights copy-on-write. basic-pitch is left to the workers:
+    TensorFlow's runtime does not survive a fork.
+    """
+    get_demucs(default_profile.demucs_model)
+
+if app.config['WARM_MODELS']:
+    # load Demucs and basic-pitch in the background so the server comes up immediately
+    threading.Thread(target=warm_default_models, daemon=True).start()
+
+METRICS.describe('app_import_seconds', 'gauge', 'Time taken to import and set up app.py.')
+METRICS.set('app_import_seconds', time.perf_counter() - _import_started, pid=os.getpid())
+
+@app.teardown_request
+def discard_uploads(exc):
+    # uploads no job took over: invalid requests, rejected or interrupted bodies
+    request.discard_unclaimed()
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    METRICS.inc('uploads_total', outcome='too_large')
+    return jsonify({"error": f"Upload larger than {app.config['MAX_UPLOAD_MB']:g} MB"}), 413
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def wants_json():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
+
+def queue_full(retry_after):
+    METRICS.inc('uploads_total', outcome='rejected')
+    response = jsonify({"error": "Server busy, try again later", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def parse_time(value):
+    # seconds from "75", "75.5" or "1:15"
+    seconds = 0.0
+    for part in value.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_window(form):
+    start, end = form.get('start', '').strip(), form.get('end', '').strip()
+    if not start and not end:
+        return None
+    start = parse_time(start) if start else 0.0
+    end = parse_time(end) if end else start + app.config['PREVIEW_SECONDS']
+    # nan and inf would slip through the comparisons below
+    if not (math.isfinite(start) and math.isfinite(end)):
+        raise ValueError('window bounds must be finite')
+    if start < 0 or end - start < 1:
+        raise ValueError('window must be at least one second long')
+    return (start, end)
+
+def run_job(job, filepath, stems, key, drum_sensitivity, render_pdf, window=None, followup=None, full_key=None,
+            profile=None):
+    # each job builds its output in its own staging folder and publishes it under the cache key
+    staging = cache.staging_dir(job.id)
+    if render_pdf:
+        get_render_service(app.config['RENDER_WORKERS'])
+    extra_meta = None
+    if window is not None:
+        extra_meta = {"preview": {"start": window[0], "end": window[1]}, "full_result_id": full_key}
+    try:
+        failed = process_song(filepath, staging, stems, job.song_name, progress=job.set_stage,
+                              drum_sensitivity=drum_sensitivity,
+                              in_memory=app.config['STEM_HANDOFF'] == 'memory',
+                              stem_format=app.config['STEM_FORMAT'],
+                              stream_min_seconds=app.config['STREAMING_MIN_SECONDS'],
+                              max_memory_mb=app.config['MAX_CHUNK_MEMORY_MB'],
+                              render_pdf=render_pdf,
+                              keep_analysis=app.config['KEEP_ANALYSIS'],
+                              stem_workers=app.config['STEM_WORKERS'],
+                              window=window,
+                              extra_meta=extra_meta,
+                              profile=profile)
+        # a result that lost stems to errors is shown, but not reused for the next identical upload
+        cache.commit(staging, key, complete=not failed)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        if followup is not None:
+            # the full-song job starts once the preview is out and takes over the upload
+            jobs.start(followup, run_job, filepath, stems, full_key, drum_sensitivity, render_pdf, profile=profile)
+        else:
+            shutil.rmtree(os.path.dirname(filepath), ignore_errors=True)
+        with inflight_lock:
+            inflight.pop(key, None)
+    cache.evict()
+    return key
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', profiles=list(PROFILES), default_profile=default_profile.name)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    # Clean up everything old for a fresh run
-    if os.path.exists(OUTPUT_BASE):
-        shutil.rmtree(OUTPUT_BASE)
-    os.makedirs(OUTPUT_BASE, exist_ok=True)
-
-    if 'file' not in request.files:
+    # reject before the upload body is parsed when the queue is already full
+    if jobs.full():
+        return queue_full(jobs.retry_after())
+    # request-side spans go into the trace the job continues
+    trace = Trace(uuid.uuid4().hex)
+    # the body is parsed here; the file is written to its upload folder and hashed as it arrives
+    with tracing(trace), span("upload.receive") as received:
+        files = request.files
+    if 'file' not in files:
         return 'No file part'
     file = request.files['file']
     if file.filename == '':
         return 'No selected file'
     stem = request.form.get('stem')
-    stems = ["bass", "drums", "piano", "guitar", "vocals"] if stem == "all" else [stem]
+    stems = ALL_STEMS if stem == "all" else [stem]
+    if not all(s in ALL_STEMS for s in stems):
+        return 'Invalid stem'
+    profile = PROFILES.get(request.form.get('profile') or default_profile.name)
+    if profile is None:
+        return 'Invalid profile'
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Build demucs command exactly as before
-        cmd = ["--mp3", "-n", "htdemucs_6s"]
-        if len(stems) == 1:
-            cmd += ["--two-stems", stems[0]]
-        cmd.append(filepath)
+        song_name = os.path.splitext(filename)[0]
 
-        # Run Demucs separation
-        demucs.separate.main(cmd)
+        upload = file.stream
+        upload.claimed = True
+        upload.close()
+        upload_dir, filepath = upload.upload_dir, upload.path
+        received.attrs["bytes"] = upload.size
 
-        song_name = os.path.splitext(filename)[0]
-        separated_dir = os.path.join('separated', 'htdemucs_6s', song_name)
-        out_dir = os.path.join(app.config['OUTPUT_BASE'], song_name)
-        os.makedirs(out_dir, exist_ok=True)
-
-        # Move all separated files to the single output folder for this song
-        if os.path.exists(separated_dir):
-            for f in os.listdir(separated_dir):
-                src = os.path.join(separated_dir, f)
-                dst = os.path.join(out_dir, f)
-                if os.path.exists(dst):
-                    os.remove(dst)
-                shutil.move(src, dst)
-        else:
-            return f"Separation output folder not found: {separated_dir}"
-
-        # Generate MIDI & PDF for available stems
-        for s in stems:
-            stem_file_mp3 = os.path.join(out_dir, f"{s}.mp3")
-            stem_file_wav = os.path.join(out_dir, f"{s}.wav")
-            stem_file = None
-            if os.path.exists(stem_file_mp3):
-                stem_file = stem_file_mp3
-            elif os.path.exists(stem_file_wav):
-                stem_file = stem_file_wav
+        drum_sensitivity = request.form.get('sensitivity', DRUM_SENSITIVITY, type=float)
+        # notation can be switched off per request (pdf=0) or for the whole deployment
+        render_pdf = app.config['RENDER_PDF'] and request.form.get('pdf', '1') != '0'
+        # start/end ask for a preview of that excerpt first; full=0 skips the full song afterwards
+        try:
+            window = parse_window(request.form)
+        except ValueError:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return 'Invalid time window'
+        full = window is not None and request.form.get('full', '1') != '0'
+
+        key = result_key(upload.hasher, processing_params(stems, drum_sensitivity, app.config['STEM_FORMAT'],
+                                                          render_pdf, window, profile))
+        full_key = None
+        if full:
+            full_key = result_key(upload.hasher, processing_params(stems, drum_sensitivity, app.config['STEM_FORMAT'],
+                                                                   render_pdf, profile=profile))
+
+        with inflight_lock:
+            job = inflight.get(key)
+            cached = job is None and cache.lookup(key) is not None
+            if job is None and not cached:
+                try:
+                    job = jobs.create(song_name, trace=trace)
+                except QueueFull as e:
+                    shutil.rmtree(upload_dir, ignore_errors=True)
+                    return queue_full(e.retry_after)
+                inflight[key] = job
+                outcome = 'queued'
             else:
-                print(f"[info] stem file not found for {s}: looked for {stem_file_mp3} and {stem_file_wav}")
-                continue
+                # served from cache, or the same audio and parameters are already being processed
+                outcome = 'cached' if cached else 'shared'
 
-            if s == "drums":
+            # the full song is queued behind the preview unless it is already done or underway
+            full_job = None
+            if full_key and full_key not in inflight and cache.lookup(full_key) is None:
                 try:
-                    # call the MIDIfren wrapper which runs the MIDIfren-style extraction
-                    res = run_midifren_drums(
-                        drum_audio_path=stem_file,
-                        out_dir=out_dir,
-                        sensitivity=0.45,  # tweak if needed (lower => more onsets)
-                        quantize=True,
-                        groove="4/4",
-                        bpm=None,
-                        return_debug=False
-                    )
-                    midi_path = res.get("midi_path")
-                    if midi_path:
-                        convert_midi_to_pdf(midi_path, drum_notation=True)
-                except Exception as e:
-                    print(f"Error processing drums: {e}")
+                    full_job = inflight[full_key] = jobs.create(song_name)
+                except QueueFull:
+                    full_job = None
+            if outcome == 'queued':
+                jobs.start(job, run_job, filepath, stems, key, drum_sensitivity, render_pdf,
+                           window=window, followup=full_job, full_key=full_key, profile=profile)
+            elif full_job is not None:
+                jobs.start(full_job, run_job, filepath, stems, full_key, drum_sensitivity, render_pdf, profile=profile)
             else:
-                try:
-                    midi_path = transcribe_to_midi(stem_file)
-                    if midi_path and os.path.exists(midi_path):
-                        convert_midi_to_pdf(midi_path)
-                except Exception as e:
-                    print(f"Error processing stem {s}: {e}")
-
-        return redirect(url_for('results', song_name=song_name))
+                shutil.rmtree(upload_dir, ignore_errors=True)
+        METRICS.inc('uploads_total', outcome=outcome)
+
+        extra = {"full_job_id": full_job.id} if full_job is not None else {}
+        if cached:
+            if wants_json():
+                return jsonify(dict(extra, result_id=key, cached=True, results_url=url_for('results', result_id=key)))
+            return redirect(url_for('results', result_id=key))
+        if wants_json():
+            return jsonify(dict(extra, job_id=job.id, status_url=url_for('job_status', job_id=job.id))), 202
+        return redirect(url_for('job_page', job_id=job.id))
     else:
         return 'Invalid file format'
 
-@app.route('/results/<song_name>')
-def results(song_name):
-    folder_path = os.path.join(app.config['OUTPUT_BASE'], song_name)
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    job = jobs.status(job_id)
+    if job is None:
+        return 'Unknown job.', 404
+    if job['status'] == 'done':
+        return redirect(url_for('results', result_id=job['result_id']))
+    return render_template('status.html', job=job)
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    data = jobs.status(job_id)
+    if data is None:
+        return jsonify({"error": "Unknown job"}), 404
+    data["trace_url"] = url_for('job_trace_page', job_id=job_id)
+    if data['status'] == 'done':
+        data["results_url"] = url_for('results', result_id=data['result_id'])
+    return jsonify(data)
+
+@app.route('/jobs/<job_id>/trace')
+def job_trace_page(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return 'Unknown job.', 404
+    trace = job.trace.to_dict()
+    total = max((s["offset"] + (s["duration"] or 0) for s in trace["spans"]), default=0)
+    return render_template('trace.html', job=job.to_dict(), trace=trace, total=total)
+
+@app.route('/api/jobs/<job_id>/trace')
+def job_trace(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.trace.to_dict())
+
+@app.route('/api/queue')
+def queue_status():
+    return jsonify({"jobs": jobs.counts(), "max_pending": jobs.max_pending, "slots": get_scheduler().stats()})
+
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+def result_dir(result_id):
+    return os.path.join(app.config['OUTPUT_BASE'], secure_filename(result_id))
+
+def result_files(folder_path):
+    """The downloadable files of a result: stems, MIDI and PDFs, without meta.json and the analysis."""
+    return sorted(f for f in os.listdir(folder_path)
+                  if f != META_FILE and not f.startswith(('_', '.')) and os.path.isfile(os.path.join(folder_path, f)))
+
+def read_meta(folder_path):
+    try:
+        with open(os.path.join(folder_path, META_FILE)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+@app.route('/results/<result_id>')
+def results(result_id):
+    folder_path = result_dir(result_id)
     if not os.path.exists(folder_path):
         return 'No results for this song.'
-    files = os.listdir(folder_path)
+    meta = read_meta(folder_path)
+    song_name = meta.get("song_name", result_id)
+    # a preview gives way to the full song once that is done (?preview=1 keeps the excerpt)
+    full_id = meta.get("full_result_id")
+    if full_id and not request.args.get('preview') and cache.lookup(full_id, partial=True) is not None:
+        return redirect(url_for('results', result_id=full_id))
+    full_job = inflight.get(full_id) if full_id else None
+    full_status_url = url_for('job_status', job_id=full_job.id) if full_job is not None else None
     labeled_tracks = []
-    for f in files:
-        file_url = url_for('static', filename=f'separated/{song_name}/{f}')
+    for f in result_files(folder_path):
+        file_url = url_for('static', filename=f'separated/{result_id}/{f}')
         labeled_tracks.append((file_url, f))
-    return render_template('results.html', song_name=song_name, labeled_tracks=labeled_tracks)
-
-@app.route('/download/<song_name>/<filename>')
-def download_file(song_name, filename):
-    directory = os.path.join(app.config['OUTPUT_BASE'], song_name)
-    return send_from_directory(directory, filename, as_attachment=True)
+    return render_template('results.html', song_name=song_name, result_id=result_id, labeled_tracks=labeled_tracks,
+                           preview=meta.get("preview"), full_status_url=full_status_url)
+
+def parse_flag(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if str(value).lower() in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+def parse_retranscribe_options(data):
+    """Every re-transcription setting, taken from `data` or defaulted, validated."""
+    from utils.drum_transcribe import parse_groove
+    opts = {}
+    for name, default in RETRANSCRIBE_DEFAULTS.items():
+        value = data.get(name, default)
+        if name == 'groove':
+            parse_groove(str(value))
+            value = str(value)
+        elif name in ('quantize', 'melodia_trick'):
+            value = parse_flag(value)
+        elif name == 'bpm':
+            value = None if value in (None, '') else int(value)
+            if value is not None and value <= 0:
+                raise ValueError("bpm must be positive")
+        else:
+            value = float(value)
+            if value < 0 or (name.endswith('_threshold') and value > 1):
+                raise ValueError(f"{name} out of range")
+        opts[name] = value
+    return opts
+
+@app.route('/api/results/<result_id>/retranscribe', methods=['POST'])
+def retranscribe(result_id):
+    # redo MIDI (and optionally PDF) of a finished result from its saved analysis, without Demucs or basic-pitch
+    result_id = secure_filename(result_id)
+    src = cache.lookup(result_id, partial=True)
+    if src is None:
+        return jsonify({"error": "Unknown result"}), 404
+    data = request.get_json(silent=True) or request.form.to_dict()
+    available = retranscribable_stems(src)
+    stems = data.get('stems') or available
+    if isinstance(stems, str):
+        stems = [stems]
+    missing = [s for s in stems if s not in available]
+    if missing or not stems:
+        return jsonify({"error": "No saved analysis for " + (", ".join(missing) or "this result"),
+                        "available": available}), 409
+    try:
+        options = parse_retranscribe_options(data)
+        render_pdf = app.config['RENDER_PDF'] and parse_flag(data.get('pdf', False))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    key = derived_key(result_id, {"stems": sorted(stems), "options": options, "pdf": render_pdf})
+    cached = cache.lookup(key) is not None
+    if not cached:
+        staging = cache.staging_dir(uuid.uuid4().hex)
+        try:
+            retranscribe_result(src, staging, stems, options, render_pdf=render_pdf)
+            cache.commit(staging, key)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        cache.evict()
+    return jsonify({
+        "result_id": key,
+        "cached": cached,
+        "results_url": url_for('results', result_id=key),
+        "midi": {s: url_for('download_file', result_id=key, filename=midi_name(s)) for s in stems},
+    })
+
+@app.route('/download/<result_id>/<filename>')
+def download_file(result_id, filename):
+    # send_file answers Range (206) and If-None-Match / If-Modified-Since (304) itself
+    return send_from_directory(result_dir(result_id), filename, as_attachment=True,
+                               max_age=app.config['DOWNLOAD_MAX_AGE'])
+
+@app.route('/download/<result_id>.zip')
+def download_zip(result_id):
+    """Every file of a result in one zip, streamed as it is written."""
+    folder_path = result_dir(result_id)
+    if cache.lookup(secure_filename(result_id), partial=True) is None:
+        return 'No results for this song.', 404
+    # answered here rather than by make_conditional, which would read the whole zip into memory
+    # to set Content-Length
+    if request.if_none_match.contains_weak(result_id):
+        response = Response(status=304)
+    else:
+        song_name = secure_filename(read_meta(folder_path).get("song_name", "")) or result_id
+        files = [(f"{song_name}/{f}", os.path.join(folder_path, f)) for f in result_files(folder_path)]
+        response = Response(stream_zip(files), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{song_name}.zip"'
+    response.set_etag(result_id)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['DOWNLOAD_MAX_AGE']
+    return response
 
 @app.route('/api/get-lyrics', methods=['POST'])
 def get_lyrics():
-    import requests
-    from bs4 import BeautifulSoup
-    import re
-    from flask import jsonify, request
-
-    def clean_string(s):
-        return re.sub(r"[^a-zA-Z0-9 ]", "", s).lower().strip()
-
-    def fetch_azlyrics(artist, title):
-        artist_clean = clean_string(artist).replace(" ", "")
-        title_clean = clean_string(title).replace(" ", "")
-        url = f"https://www.azlyrics.com/lyrics/{artist_clean}/{title_clean}.html"
-
-        try:
-            r = requests.get(url, timeout=10)
-            if r.status_code != 200:
-                return None
-
-            soup = BeautifulSoup(r.text, "html.parser")
-
-            # lyrics live inside the first large <div> after comments
-            divs = soup.find_all("div")
-            for div in divs:
-                if div.get("class") is None and div.get("id") is None:
-                    text = div.get_text("\n").strip()
-                    if len(text.split()) > 20:
-                        return text
-            return None
-        except:
-            return None
-
-    def fetch_genius_scrape(query):
-        try:
-            search_url = f"https://genius.com/api/search/song?q={query}"
-            json_data = requests.get(search_url, timeout=10).json()
-            hits = json_data["response"]["sections"][0]["hits"]
-            if not hits:
-                return None
-
-            url = hits[0]["result"]["url"]
-            page = requests.get(url, timeout=10).text
-            soup = BeautifulSoup(page, "html.parser")
-
-            lyrics_divs = soup.find_all("div", {"data-lyrics-container": "true"})
-            if not lyrics_divs:
-                return None
-
-            lyrics = "\n".join([d.get_text("\n") for d in lyrics_divs])
-            return lyrics.strip()
-        except:
-            return None
-
     # --- get user inputs ---
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     song = (data.get("song") or "").strip()
     artist = (data.get("artist") or "").strip()
 
     if not song or not artist:
         return jsonify({"error": "Song and artist are required"}), 400
 
-    # 1) Try AZLyrics
-    lyrics = fetch_azlyrics(artist, song)
-    if lyrics:
-        return jsonify({"lyrics": lyrics})
-
-    # 2) Try Genius fallback
-    query = f"{artist} {song}"
-    lyrics = fetch_genius_scrape(query)
+    # AZLyrics and Genius are queried concurrently; cached per (artist, song)
+    lyrics = lyrics_service.lookup(artist, song)
     if lyrics:
         return jsonify({"lyrics": lyrics})
 
@@ -0,0 +1,285 @@
+"""
+Offline batch processing of a whole directory (or manifest) of songs.
+
+    python batch.py music/ --stem all
+    python batch.py songs.txt --out static/separated --separate-workers 1 --transcribe-workers 2
+
+Separation and transcription run in separate process pools, so Demucs works on
+the next song while the previous one is transcribed and rendered. Results land
+in the same content-addressed store the web app serves (/results/<result_id>),
+which also makes runs resumable: songs whose result already exists are skipped.
+The progress log and the final report go to --log-dir (var/batch), outside
+static/, which the web app serves to anyone.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+from utils.cache import ResultCache, hash_audio
+from utils.scheduler import default_cpu_count, partition_threads
+
+AUDIO_EXTENSIONS = {'mp3', 'wav', 'flac', 'ogg'}
+PROGRESS_FILE = 'batch_progress.jsonl'
+REPORT_FILE = 'batch_report.json'
+
+
+def find_songs(source: str) -> List[str]:
+    """Audio files below a directory, or the paths listed in a manifest (one per line, # comments)."""
+    if os.path.isdir(source):
+        songs = []
+        for root, _, files in os.walk(source):
+            songs.extend(os.path.join(root, f) for f in files
+                         if f.rsplit('.', 1)[-1].lower() in AUDIO_EXTENSIONS)
+        return sorted(songs)
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as fh:
+        lines = [line.strip() for line in fh]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+
+def _init_worker(torch_threads: int, tf_threads: int):
+    from utils.models import set_thread_limits
+    set_thread_limits(torch_threads, tf_threads)
+
+
+def separate_song(filepath: str, staging: str, stems: List[str], drum_sensitivity: float, stem_format: str,
+                  stream_min_seconds: float, max_memory_mb: float, profile_name: Optional[str] = None) -> Dict[str, Any]:
+    """Separation worker: stems into `staging`. Long recordings are also transcribed here, chunk by chunk."""
+    from utils.profiles import get_profile
+    from utils.separate import separate_file
+    from utils.streaming import audio_duration, stream_song
+
+    profile = get_profile(profile_name)
+    start = time.perf_counter()
+    os.makedirs(staging, exist_ok=True)
+    duration = audio_duration(filepath)
+    midi_paths = None
+    if stream_min_seconds and duration > stream_min_seconds:
+        midi_paths = stream_song(filepath, staging, stems, max_memory_mb, drum_sensitivity, stem_format=stem_format,
+                                 model_name=profile.demucs_model, demucs_options=profile.demucs_options(),
+                                 basic_pitch_path=profile.basic_pitch_path())
+    else:
+        separate_file(filepath, staging, stems, model_name=profile.demucs_model, ext=stem_format,
+                      options=profile.demucs_options())
+    return {'audio_seconds': duration, 'midi_paths': midi_paths, 'separate_s': time.perf_counter() - start}
+
+
+def transcribe_song(staging: str, stems: List[str], song_name: str, params: Dict[str, Any],
+                    drum_sensitivity: float, render_pdf: bool, midi_paths=None,
+                    profile_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Transcription worker: MIDI for every stem, PDFs in one MuseScore batch, then meta.json.
+    'failed' in the returned dict lists the stems that lost outputs to errors.
+    """
+    from utils.midi_to_pdf import convert_batch
+    from utils.pipeline import ANALYSIS_DIR, find_stem_file, transcribe_stem, write_meta
+    from utils.profiles import get_profile
+
+    basic_pitch_path = get_profile(profile_name).basic_pitch_path()
+    start = time.perf_counter()
+    failed = {}
+    if midi_paths is None:
+        midi_paths = {}
+        for s in stems:
+            stem_file = find_stem_file(staging, s)
+            if stem_file is None:
+                print(f"[batch] stem file not found for {s} in {staging}")
+                failed[s] = "stem file not found"
+                continue
+            try:
+                midi_paths[s] = transcribe_stem(s, stem_file, staging, drum_sensitivity,
+                                                analysis_dir=os.path.join(staging, ANALYSIS_DIR),
+                                                basic_pitch_path=basic_pitch_path)
+            except Exception as e:
+                print(f"[batch] error transcribing {s}: {e}")
+                failed[s] = f"{type(e).__name__}: {e}"
+    failed.update((s, "no MIDI produced") for s, m in midi_paths.items() if not m)
+    transcribe_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if render_pdf:
+        pdfs = convert_batch([m for m in midi_paths.values() if m])
+        failed.update((s, "no PDF rendered") for s, m in midi_paths.items() if m and pdfs.get(str(m)) is None)
+    write_meta(staging, song_name, stems, params, failed=failed)
+    return {'transcribe_s': transcribe_s, 'render_s': time.perf_counter() - start, 'failed': failed}
+
+
+class BatchRun:
+    """Feeds songs through the two pools and keeps the progress log."""
+
+    def __init__(self, songs: List[str], opts):
+        from utils.pipeline import ALL_STEMS, processing_params
+        from utils.profiles import get_profile
+
+        self.opts = opts
+        self.cache = ResultCache(opts.out)
+        self.stems = ALL_STEMS if opts.stem == 'all' else [opts.stem]
+        self.params = processing_params(self.stems, opts.sensitivity, opts.format, opts.pdf,
+                                        profile=get_profile(opts.profile))
+        self.songs = songs
+        self.records: List[Dict[str, Any]] = []
+        self._log = open(os.path.join(opts.log_dir, PROGRESS_FILE), 'a')
+
+    def log(self, record: Dict[str, Any]):
+        self.records.append(record)
+        self._log.write(json.dumps(record) + '\n')
+        self._log.flush()
+        status = record['status']
+        extra = f" ({record['error']})" if record.get('error') else ''
+        print(f"[batch] {status:<8} {record['path']}{extra}")
+
+    def run(self):
+        opts = self.opts
+        todo = []
+        for path in self.songs:
+            key = hash_audio(path, self.params)
+            if self.cache.lookup(key) is not None:
+                self.log({'path': path, 'result_id': key, 'status': 'skipped'})
+            else:
+                todo.append((path, key))
+
+        torch_threads, tf_threads = partition_threads(default_cpu_count(), opts.separate_workers,
+                                                      opts.transcribe_workers)
+        # every transcriber is its own process with its own TensorFlow pool, so each gets one slot's share
+        tf_threads = max(1, tf_threads // max(1, opts.transcribe_workers))
+        ctx = multiprocessing.get_context('spawn')
+        init = (_init_worker, (torch_threads, tf_threads))
+        separators = ProcessPoolExecutor(opts.separate_workers, mp_context=ctx, initializer=init[0], initargs=init[1])
+        transcribers = ProcessPoolExecutor(opts.transcribe_workers, mp_context=ctx, initializer=init[0],
+                                           initargs=init[1])
+        # separated songs waiting for a transcriber are held on disk; cap how far separation runs ahead
+        max_ahead = opts.transcribe_workers + opts.max_ahead
+        separating, transcribing = {}, {}
+        try:
+            while todo or separating or transcribing:
+                while todo and len(separating) < opts.separate_workers and \
+                        len(separating) + len(transcribing) < opts.separate_workers + max_ahead:
+                    path, key = todo.pop(0)
+                    item = {'path': path, 'result_id': key, 'staging': self.cache.staging_dir(uuid.uuid4().hex),
+                            'started': time.time()}
+                    future = separators.submit(separate_song, path, item['staging'], self.stems, opts.sensitivity,
+                                               opts.format, opts.streaming_min_seconds, opts.max_chunk_memory_mb,
+                                               opts.profile)
+                    separating[future] = item
+
+                done, _ = wait(list(separating) + list(transcribing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in separating:
+                        item = separating.pop(future)
+                        try:
+                            item.update(future.result())
+                        except Exception as e:
+                            self.fail(item, e)
+                            continue
+                        song_name = os.path.splitext(os.path.basename(item['path']))[0]
+                        tf = transcribers.submit(transcribe_song, item['staging'], self.stems, song_name,
+                                                 self.params, opts.sensitivity, opts.pdf, item.pop('midi_paths'),
+                                                 opts.profile)
+                        transcribing[tf] = item
+                    else:
+                        item = transcribing.pop(future)
+                        try:
+                            item.update(future.result())
+                            # songs with failed stems are redone on the next run
+                            self.cache.commit(item['staging'], item['result_id'], complete=not item.get('failed'))
+                        except Exception as e:
+                            self.fail(item, e)
+                            continue
+                        self.finish(item, 'done')
+        finally:
+            separators.shutdown(cancel_futures=True)
+            transcribers.shutdown(cancel_futures=True)
+            self._log.close()
+
+    def fail(self, item: Dict[str, Any], error: Exception):
+        shutil.rmtree(item['staging'], ignore_errors=True)
+        item['error'] = f"{type(error).__name__}: {error}"
+        self.finish(item, 'failed')
+
+    def finish(self, item: Dict[str, Any], status: str):
+        record = {k: v for k, v in item.items() if k != 'staging'}
+        record['status'] = status
+        record['wall_s'] = time.time() - item['started']
+        self.log(record)
+
+    def report(self, wall_s: float) -> Dict[str, Any]:
+        done = [r for r in self.records if r['status'] == 'done']
+        audio_s = sum(r.get('audio_seconds', 0) for r in done)
+        hours = wall_s / 3600
+
+        def mean(field):
+            values = [r[field] for r in done if field in r]
+            return sum(values) / len(values) if values else None
+
+        return {
+            'songs': len(self.records),
+            'done': len(done),
+            'skipped': sum(r['status'] == 'skipped' for r in self.records),
+            'failed': sum(r['status'] == 'failed' for r in self.records),
+            'wall_s': wall_s,
+            'songs_per_hour': len(done) / hours if hours else None,
+            'audio_hours_per_hour': audio_s / 3600 / hours if hours else None,
+            'mean_separate_s': mean('separate_s'),
+            'mean_transcribe_s': mean('transcribe_s'),
+            'mean_render_s': mean('render_s'),
+            'separate_workers': self.opts.separate_workers,
+            'transcribe_workers': self.opts.transcribe_workers,
+            'profile': self.opts.profile,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='directory of audio files, or a manifest with one path per line')
+    parser.add_argument('--out', default=os.path.join('static', 'separated'), help='result store (the web app\'s by default)')
+    parser.add_argument('--log-dir', default=os.path.join('var', 'batch'),
+                        help=f'where {PROGRESS_FILE} and {REPORT_FILE} are written; keep it outside static/')
+    parser.add_argument('--stem', default='all', help='stem to transcribe, or "all"')
+    parser.add_argument('--sensitivity', type=float, default=0.45, help='drum onset sensitivity')
+    parser.add_argument('--format', default=os.environ.get('STEM_FORMAT', 'mp3'), choices=('mp3', 'flac', 'wav'))
+    parser.add_argument('--no-pdf', dest='pdf', action='store_false', help='skip MuseScore notation')
+    parser.add_argument('--profile', default=os.environ.get('PROFILE', 'balanced'),
+                        help='quality/speed profile: quality, balanced or fast')
+    parser.add_argument('--separate-workers', type=int, default=1)
+    parser.add_argument('--transcribe-workers', type=int, default=1)
+    parser.add_argument('--max-ahead', type=int, default=1, help='separated songs allowed to wait for a transcriber')
+    parser.add_argument('--streaming-min-seconds', type=float,
+                        default=float(os.environ.get('STREAMING_MIN_SECONDS', 600)))
+    parser.add_argument('--max-chunk-memory-mb', type=float, default=float(os.environ.get('MAX_CHUNK_MEMORY_MB', 1024)))
+    opts = parser.parse_args(argv)
+
+    from utils.pipeline import ALL_STEMS
+    from utils.profiles import PROFILES
+    if opts.stem != 'all' and opts.stem not in ALL_STEMS:
+        parser.error(f"unknown stem {opts.stem}")
+    if opts.profile not in PROFILES:
+        parser.error(f"unknown profile {opts.profile}")
+    songs = find_songs(opts.source)
+    if not songs:
+        parser.error(f"no audio files in {opts.source}")
+
+    os.makedirs(opts.out, exist_ok=True)
+    os.makedirs(opts.log_dir, exist_ok=True)
+    run = BatchRun(songs, opts)
+    start = time.time()
+    run.run()
+    report = run.report(time.time() - start)
+    with open(os.path.join(opts.log_dir, REPORT_FILE), 'w') as fh:
+        json.dump(report, fh, indent=2)
+
+    print(f"\n{report['done']} done, {report['skipped']} skipped, {report['failed']} failed "
+          f"in {report['wall_s']:.0f}s")
+    if report['songs_per_hour']:
+        print(f"{report['songs_per_hour']:.1f} songs/hour, {report['audio_hours_per_hour']:.2f} h of audio per hour")
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
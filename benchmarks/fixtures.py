@@ -0,0 +1,92 @@
+"""
+Synthetic audio for the benchmarks: click tracks, drum patterns and sine
+melodies of any length and density, with their ground truth.
+"""
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+import soundfile as sf
+
+SR = 44100
+
+
+def _envelope(n, decay, sr=SR):
+    return np.exp(-np.arange(n) / sr * decay).astype(np.float32)
+
+
+def click_track(seconds: float, bpm: float = 120, sr: int = SR):
+    """Short noise bursts on every beat. Returns (y, onset times)."""
+    rng = np.random.default_rng(0)
+    y = np.zeros(int(seconds * sr), dtype=np.float32)
+    click = rng.standard_normal(int(0.005 * sr)).astype(np.float32) * _envelope(int(0.005 * sr), 600, sr)
+    times = np.arange(0, seconds - 0.01, 60.0 / bpm)
+    for t in times:
+        s = int(t * sr)
+        y[s:s + len(click)] += click[:len(y) - s]
+    return y, times.tolist()
+
+
+def drum_pattern(seconds: float, bpm: float = 120, density: int = 2, seed: int = 0, sr: int = SR):
+    """
+    Kick, snare and hat hits on a grid of `density` hits per beat.
+    Returns (y, [(time, gm note)]).
+    """
+    rng = np.random.default_rng(seed)
+    n = int(0.15 * sr)
+    t = np.arange(n) / sr
+    kick = (np.sin(2 * np.pi * 60 * t) * _envelope(n, 30, sr)).astype(np.float32)
+    snare = (rng.standard_normal(n) * _envelope(n, 25, sr) * 0.6).astype(np.float32)
+    hat = (np.diff(rng.standard_normal(n + 1)) * _envelope(n, 80, sr) * 0.3).astype(np.float32)
+    sounds = {36: kick, 38: snare, 42: hat}
+
+    y = np.zeros(int(seconds * sr), dtype=np.float32)
+    hits = []
+    step = 60.0 / bpm / density
+    for i, time in enumerate(np.arange(0.25, seconds - 0.2, step)):
+        beat = i // density
+        note = 36 if i % density == 0 and beat % 2 == 0 else 38 if i % density == 0 else 42
+        s = int(time * sr)
+        y[s:s + n] += sounds[note][:len(y) - s] * rng.uniform(0.5, 1.0)
+        hits.append((float(time), note))
+    return y, hits
+
+
+def sine_melody(seconds: float, notes_per_second: float = 2, seed: int = 0, sr: int = SR):
+    """Monophonic sine notes. Returns (y, [(start, end, midi pitch)])."""
+    rng = np.random.default_rng(seed)
+    y = np.zeros(int(seconds * sr), dtype=np.float32)
+    notes = []
+    length = 1.0 / notes_per_second
+    for start in np.arange(0.25, seconds - length, length):
+        pitch = int(rng.integers(48, 84))
+        n = int(length * 0.9 * sr)
+        t = np.arange(n) / sr
+        tone = np.sin(2 * np.pi * 440.0 * 2 ** ((pitch - 69) / 12) * t) * np.minimum(1, t * 200) * _envelope(n, 3, sr)
+        s = int(start * sr)
+        y[s:s + n] += 0.5 * tone.astype(np.float32)
+        notes.append((float(start), float(start + length * 0.9), pitch))
+    return y, notes
+
+
+def build_fixtures(out_dir: str, durations=(10, 30, 60), densities=(1, 2, 4)) -> List[Dict]:
+    """Write every fixture as WAV (plus ground truth JSON) and return their descriptions."""
+    os.makedirs(out_dir, exist_ok=True)
+    fixtures = []
+    for seconds in durations:
+        specs = [("click", f"click_{seconds}s", lambda: click_track(seconds), None)]
+        for d in densities:
+            specs.append(("drums", f"drums_{seconds}s_d{d}", lambda d=d: drum_pattern(seconds, density=d), d))
+            specs.append(("melody", f"melody_{seconds}s_d{d}", lambda d=d: sine_melody(seconds, notes_per_second=d), d))
+        for kind, name, make, density in specs:
+            path = os.path.join(out_dir, f"{name}.wav")
+            truth_path = os.path.join(out_dir, f"{name}.json")
+            if not (os.path.exists(path) and os.path.exists(truth_path)):
+                y, truth = make()
+                sf.write(path, y, SR)
+                with open(truth_path, "w") as fh:
+                    json.dump(truth, fh)
+            fixtures.append({"name": name, "kind": kind, "path": path, "truth": truth_path,
+                             "seconds": seconds, "density": density})
+    return fixtures
@@ -0,0 +1,204 @@
+"""
+Speed against accuracy for every quality/speed profile (utils/profiles.py).
+
+    python -m benchmarks.profiles --out profiles.json
+    python -m benchmarks.profiles --profiles fast,balanced --real-demucs
+
+Transcription runs each profile's basic-pitch backend on the sine-melody
+fixtures and scores the notes against their ground truth (onset within 50 ms,
+same pitch). With --real-demucs each profile also separates a drums + melody
+mix and the drum stem is scored by its SDR against the drum fixture. As in
+benchmarks.run, every measurement runs in a fresh interpreter.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import SR, build_fixtures  # noqa: E402
+from benchmarks.run import _number, _peak_rss_mb  # noqa: E402
+
+ONSET_TOLERANCE = 0.05
+
+
+def note_scores(truth, notes, tolerance=ONSET_TOLERANCE):
+    """Precision, recall and F1 of (start, pitch) pairs; each true note matches at most one estimate."""
+    unmatched = sorted(truth)
+    hits = 0
+    for start, pitch in sorted(notes):
+        for i, (t, p) in enumerate(unmatched):
+            if p == pitch and abs(t - start) <= tolerance:
+                del unmatched[i]
+                hits += 1
+                break
+    precision = hits / len(notes) if notes else 0.0
+    recall = hits / len(truth) if truth else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if hits else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def sdr(reference, estimate):
+    """Signal-to-distortion ratio in dB over the common length."""
+    import numpy as np
+    n = min(len(reference), len(estimate))
+    reference, estimate = reference[:n], estimate[:n]
+    noise = np.sum((reference - estimate) ** 2)
+    return float(10 * np.log10(np.sum(reference ** 2) / noise)) if noise else float("inf")
+
+
+def _mix(fixtures, work_dir):
+    """drums + melody of the same length and density, written next to the fixtures."""
+    import soundfile as sf
+    drums, melody = fixtures
+    y = sf.read(drums["path"], dtype="float32")[0] + sf.read(melody["path"], dtype="float32")[0]
+    path = os.path.join(work_dir, "mix.wav")
+    sf.write(path, y, SR)
+    return path
+
+
+def run_child(task, profile_name, fixtures, opts):
+    """Body of the per-measurement subprocess; reports one JSON line."""
+    from utils.profiles import get_profile
+
+    profile = get_profile(profile_name)
+    result = {"task": task, "profile": profile_name, "fixture": fixtures[-1]["name"],
+              "audio_seconds": fixtures[-1]["seconds"], "settings": profile.to_dict(), "status": "ok"}
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            if task == "transcribe":
+                import soundfile as sf
+                from utils.models import get_basic_pitch
+                from utils.transcribe import notes_from_array
+                fixture = fixtures[0]
+                y, sr = sf.read(fixture["path"], dtype="float32")
+                start = time.perf_counter()
+                get_basic_pitch(profile.basic_pitch_path())
+                result["load_s"] = time.perf_counter() - start
+                start = time.perf_counter()
+                _, events = notes_from_array(y, sr, model_path=profile.basic_pitch_path())
+                result["wall_s"] = time.perf_counter() - start
+                with open(fixture["truth"]) as fh:
+                    truth = [(s, p) for s, _, p in json.load(fh)]
+                result.update(note_scores(truth, [(float(e[0]), int(e[2])) for e in events]))
+            elif task == "separate":
+                import librosa
+                import soundfile as sf
+                from utils.models import get_demucs
+                from utils.separate import separate_to_memory
+                path = _mix(fixtures, work_dir)
+                get_demucs(profile.demucs_model)
+                start = time.perf_counter()
+                outputs, samplerate = separate_to_memory(path, ["drums"], profile.demucs_model,
+                                                         profile.demucs_options())
+                result["wall_s"] = time.perf_counter() - start
+                reference = sf.read(fixtures[0]["path"], dtype="float32")[0]
+                estimate = librosa.resample(outputs["drums"].mean(0).cpu().numpy(), orig_sr=samplerate, target_sr=SR)
+                result["drums_sdr_db"] = sdr(reference, estimate)
+            else:
+                raise ValueError(f"unknown task {task}")
+            result["realtime_factor"] = result["audio_seconds"] / result["wall_s"] if result["wall_s"] else None
+    except ImportError as e:
+        result["status"] = "skipped"
+        result["error"] = str(e)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["peak_rss_mb"] = _peak_rss_mb()
+    print("BENCH_RESULT " + json.dumps(result))
+
+
+def run_measurement(task, profile, fixtures):
+    cmd = [sys.executable, "-m", "benchmarks.profiles", "--child", task, "--profile", profile,
+           "--fixture", json.dumps(fixtures)]
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            return json.loads(line[len("BENCH_RESULT "):])
+    return {"task": task, "profile": profile, "fixture": fixtures[-1]["name"], "status": "error",
+            "error": (proc.stderr or "no result").strip().splitlines()[-1:]}
+
+
+def main(argv=None):
+    from utils.profiles import PROFILES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="profiles_output.json", help="where to write the results")
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "mta_bench_fixtures"))
+    parser.add_argument("--durations", default="10,30", help="fixture lengths in seconds")
+    parser.add_argument("--densities", default="1,2,4", help="notes per second")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--real-demucs", action="store_true", help="also time and score separation")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--profile", help=argparse.SUPPRESS)
+    parser.add_argument("--fixture", help=argparse.SUPPRESS)
+    opts = parser.parse_args(argv)
+
+    if opts.child:
+        run_child(opts.child, opts.profile, json.loads(opts.fixture), opts)
+        return 0
+
+    fixtures = build_fixtures(opts.fixtures,
+                              durations=[_number(d) for d in opts.durations.split(",")],
+                              densities=[int(d) for d in opts.densities.split(",")])
+    by_name = {f["name"]: f for f in fixtures}
+    measurements = [("transcribe", [f]) for f in fixtures if f["kind"] == "melody"]
+    if opts.real_demucs:
+        measurements += [("separate", [by_name[f["name"].replace("melody", "drums")], f])
+                         for f in fixtures if f["kind"] == "melody"]
+
+    results = []
+    for task, task_fixtures in measurements:
+        for profile in opts.profiles.split(","):
+            r = run_measurement(task, profile, task_fixtures)
+            results.append(r)
+            label = f"{task:<12}{profile:<12}{r['fixture']:<22}"
+            if r.get("status") != "ok":
+                print(f"{label} {r['status']}: {r.get('error')}")
+            elif task == "transcribe":
+                print(f"{label}{r['wall_s']:>9.3f}s  F1 {r['f1']:.3f}")
+            else:
+                print(f"{label}{r['wall_s']:>9.3f}s  SDR {r['drums_sdr_db']:.1f} dB")
+
+    summary = {}
+    for r in results:
+        if r.get("status") == "ok":
+            s = summary.setdefault(r["profile"], {}).setdefault(r["task"], {"wall_s": 0.0, "audio_seconds": 0.0,
+                                                                            "scores": []})
+            s["wall_s"] += r["wall_s"]
+            s["audio_seconds"] += r["audio_seconds"]
+            s["scores"].append(r["f1"] if r["task"] == "transcribe" else r["drums_sdr_db"])
+    # mean F1 for transcription, mean drum SDR (dB) for separation
+    print(f"\n{'profile':<12}{'task':<12}{'realtime x':>12}{'mean score':>12}")
+    for profile, tasks in summary.items():
+        for task, s in tasks.items():
+            scores = s.pop("scores")
+            s["realtime_factor"] = s["audio_seconds"] / s["wall_s"] if s["wall_s"] else None
+            s["mean_score"] = sum(scores) / len(scores)
+            print(f"{profile:<12}{task:<12}{s['realtime_factor'] or 0:>12.1f}{s['mean_score']:>12.3f}")
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "real_demucs": opts.real_demucs,
+        },
+        "summary": summary,
+        "results": results,
+    }
+    with open(opts.out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nwrote {opts.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
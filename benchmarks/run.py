@@ -0,0 +1,231 @@
+"""
+Per-stage benchmarks for the separation -> transcription -> notation pipeline.
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --out new.json --compare bench.json
+
+Every stage runs in a fresh interpreter so its peak RSS is its own. Demucs and
+MuseScore are replaced by stubs unless --real-demucs / --real-musescore is given.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import build_fixtures  # noqa: E402
+
+STAGES = {
+    # stage: fixture kinds it runs on
+    "detect_tempo": ("click", "drums"),
+    "extract_midi": ("drums",),
+    "quantize_midi_file": ("drums",),
+    "transcribe_to_midi": ("melody",),
+    "convert_midi_to_pdf": ("melody",),
+    "separation": ("drums", "melody"),
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _drum_midi(fixture, work_dir):
+    from utils.drum_transcribe import DrumBeatExtractor
+    path = os.path.join(work_dir, "drums.mid")
+    DrumBeatExtractor().extract_midi(fixture["path"], 120, 0.45, "4/4", False, False, midi_path=path)
+    return path
+
+
+def _melody_midi(fixture, work_dir):
+    from utils.midi_events import NoteEvents
+    with open(fixture["truth"]) as fh:
+        notes = json.load(fh)
+    starts, ends, pitches = (zip(*notes) if notes else ((), (), ()))
+    events = NoteEvents.from_seconds(starts, pitches, 120, channel=0)
+    ticks = NoteEvents.from_seconds(ends, pitches, 120).onset
+    events.duration = ticks - events.onset
+    return events.save(os.path.join(work_dir, "melody.mid"), tempo=120)
+
+
+def prepare(stage, fixture, work_dir, opts):
+    """Everything a stage needs that should not be timed. Returns the timed callable."""
+    if stage == "detect_tempo":
+        from utils.drum_transcribe import DrumBeatExtractor
+        return lambda: DrumBeatExtractor().detect_tempo(fixture["path"])
+
+    if stage == "extract_midi":
+        from utils.drum_transcribe import DrumBeatExtractor
+        path = os.path.join(work_dir, "drums.mid")
+
+        def run():
+            extractor = DrumBeatExtractor()
+            extractor.extract_midi(fixture["path"], 120, 0.45, "4/4", True, False, midi_path=path)
+            return len(extractor.onset_frames)
+        return run
+
+    if stage == "quantize_midi_file":
+        from utils.drum_transcribe import quantize_midi_file
+        src = _drum_midi(fixture, work_dir)
+        return lambda: quantize_midi_file(src, os.path.join(work_dir, "quantized.mid"), bpm=120)
+
+    if stage == "transcribe_to_midi":
+        import shutil
+        from utils.transcribe import transcribe_to_midi
+        path = os.path.join(work_dir, os.path.basename(fixture["path"]))
+        shutil.copy(fixture["path"], path)
+        return lambda: transcribe_to_midi(path)
+
+    if stage == "convert_midi_to_pdf":
+        from utils.midi_to_pdf import convert_midi_to_pdf
+        if not opts.real_musescore:
+            from benchmarks.stubs import install_stub_musescore
+            install_stub_musescore(os.path.join(work_dir, "bin"))
+        src = _melody_midi(fixture, work_dir)
+        return lambda: convert_midi_to_pdf(src)
+
+    if stage == "separation":
+        out_dir = os.path.join(work_dir, "stems")
+        os.makedirs(out_dir, exist_ok=True)
+        if opts.real_demucs:
+            from utils.separate import separate_file
+        else:
+            from benchmarks.stubs import stub_separate_file as separate_file
+        return lambda: separate_file(fixture["path"], out_dir, ["drums"], ext="wav")
+
+    raise ValueError(f"unknown stage {stage}")
+
+
+def run_child(stage, fixture, opts):
+    """Body of the per-stage subprocess: time `repeat` runs and report one JSON line."""
+    result = {"stage": stage, "fixture": fixture["name"], "audio_seconds": fixture["seconds"], "status": "ok"}
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            fn = prepare(stage, fixture, work_dir, opts)
+            timings = []
+            value = None
+            for _ in range(opts.repeat):
+                start = time.perf_counter()
+                value = fn()
+                timings.append(time.perf_counter() - start)
+            result["first_wall_s"] = timings[0]
+            result["wall_s"] = min(timings)
+            result["realtime_factor"] = fixture["seconds"] / result["wall_s"] if result["wall_s"] else None
+            if stage == "extract_midi":
+                result["onsets"] = value
+                result["onsets_per_sec"] = value / result["wall_s"] if result["wall_s"] else None
+        except ImportError as e:
+            result["status"] = "skipped"
+            result["error"] = str(e)
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+    result["peak_rss_mb"] = _peak_rss_mb()
+    print("BENCH_RESULT " + json.dumps(result))
+
+
+def run_stage(stage, fixture, opts):
+    cmd = [sys.executable, "-m", "benchmarks.run", "--child", stage, "--fixture", json.dumps(fixture),
+           "--repeat", str(opts.repeat)]
+    if opts.real_demucs:
+        cmd.append("--real-demucs")
+    if opts.real_musescore:
+        cmd.append("--real-musescore")
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            return json.loads(line[len("BENCH_RESULT "):])
+    return {"stage": stage, "fixture": fixture["name"], "status": "error",
+            "error": (proc.stderr or "no result").strip().splitlines()[-1:]}
+
+
+def _number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def compare(current, baseline_path, threshold):
+    """Print wall-time ratios against a previous run; returns the number of regressions."""
+    with open(baseline_path) as fh:
+        baseline = {(r["stage"], r["fixture"]): r for r in json.load(fh)["results"]}
+    regressions = 0
+    print(f"\n{'stage':<22}{'fixture':<22}{'before':>10}{'after':>10}{'ratio':>8}")
+    for r in current["results"]:
+        old = baseline.get((r["stage"], r["fixture"]))
+        if not old or r.get("status") != "ok" or old.get("status") != "ok":
+            continue
+        ratio = r["wall_s"] / old["wall_s"] if old["wall_s"] else float("inf")
+        flag = "  REGRESSION" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['stage']:<22}{r['fixture']:<22}{old['wall_s']:>10.3f}{r['wall_s']:>10.3f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_output.json", help="where to write the results")
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "mta_bench_fixtures"))
+    parser.add_argument("--durations", default="10,30,60", help="fixture lengths in seconds")
+    parser.add_argument("--densities", default="1,2,4", help="hits / notes per beat")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--real-demucs", action="store_true")
+    parser.add_argument("--real-musescore", action="store_true")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio counted as a regression")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--fixture", help=argparse.SUPPRESS)
+    opts = parser.parse_args(argv)
+
+    if opts.child:
+        run_child(opts.child, json.loads(opts.fixture), opts)
+        return 0
+
+    fixtures = build_fixtures(opts.fixtures,
+                              durations=[_number(d) for d in opts.durations.split(",")],
+                              densities=[int(d) for d in opts.densities.split(",")])
+    results = []
+    for stage in opts.stages.split(","):
+        for fixture in fixtures:
+            if fixture["kind"] not in STAGES[stage]:
+                continue
+            r = run_stage(stage, fixture, opts)
+            results.append(r)
+            if r.get("status") == "ok":
+                print(f"{stage:<22}{fixture['name']:<22}{r['wall_s']:>9.3f}s {r['peak_rss_mb']:>8.1f} MB")
+            else:
+                print(f"{stage:<22}{fixture['name']:<22} {r['status']}: {r.get('error')}")
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "real_demucs": opts.real_demucs,
+            "real_musescore": opts.real_musescore,
+            "repeat": opts.repeat,
+        },
+        "results": results,
+    }
+    with open(opts.out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nwrote {opts.out}")
+
+    if opts.compare:
+        return 1 if compare(report, opts.compare, opts.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
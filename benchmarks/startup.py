@@ -0,0 +1,180 @@
+"""
+Startup cost of the web app.
+
+    python -m benchmarks.startup --out startup.json
+    python -m benchmarks.startup --prefork 4 --out startup.json
+
+Measures, in fresh interpreters, how long `import app` takes, how long until
+the first response to `/`, the RSS at that point and which heavy libraries got
+imported along the way (none should). With --importtime the slowest imports
+are listed. With --prefork N a gunicorn server (gunicorn.conf.py) is started
+with N workers, once with the models preloaded in the master and once without,
+and the RSS, PSS and private memory of every process are reported.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from utils.metrics import memory_stats  # noqa: E402
+
+HEAVY_MODULES = ("torch", "tensorflow", "onnxruntime", "librosa", "demucs", "basic_pitch", "mido")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+status = app.app.test_client().get('/').status_code
+first = time.perf_counter()
+from utils.metrics import memory_stats
+print("BENCH_RESULT " + json.dumps({
+    "import_s": imported - start,
+    "first_response_s": first - start,
+    "status": status,
+    "memory_mb": memory_stats(),
+    "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_import(repeat):
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, capture_output=True, text=True)
+        line = next((line for line in proc.stdout.splitlines() if line.startswith("BENCH_RESULT ")), None)
+        if line is None:
+            return {"status": "error", "error": (proc.stderr or "no result").strip().splitlines()[-1:]}
+        runs.append(json.loads(line[len("BENCH_RESULT "):]))
+    best = min(runs, key=lambda r: r["import_s"])
+    return dict(best, first_import_s=runs[0]["import_s"], repeat=repeat)
+
+
+def slowest_imports(top):
+    """Cumulative `python -X importtime` figures of the slowest imports."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT,
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if m:
+            rows.append({"module": m.group(4), "cumulative_s": int(m.group(2)) / 1e6, "depth": len(m.group(3)) // 2})
+    return sorted(rows, key=lambda r: -r["cumulative_s"])[:top]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                # the process name may contain spaces; ppid is the second field after it
+                ppid = int(fh.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def measure_prefork(workers, preload, settle, timeout=600):
+    """Start gunicorn, wait until it answers and the workers have settled, then read every process' memory."""
+    port = _free_port()
+    env = dict(os.environ, PRELOAD_MODELS="1" if preload else "0", WEB_WORKERS=str(workers))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind",
+                             f"127.0.0.1:{port}", "app:app"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {"workers": workers, "preload": preload}
+    try:
+        while True:
+            if proc.poll() is not None:
+                return dict(result, status="error", error=f"gunicorn exited with {proc.returncode}")
+            if time.perf_counter() - start > timeout:
+                return dict(result, status="error", error="no response")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+                break
+            except OSError:
+                time.sleep(0.2)
+        result["first_response_s"] = time.perf_counter() - start
+        time.sleep(settle)
+        result["master_mb"] = memory_stats(proc.pid)
+        result["worker_mb"] = [memory_stats(pid) for pid in _children(proc.pid)]
+        total = [m for m in [result["master_mb"]] + result["worker_mb"] if m]
+        result["total_pss_mb"] = sum(m.get("pss", 0) for m in total)
+        result["total_rss_mb"] = sum(m.get("rss", 0) for m in total)
+        result["status"] = "ok"
+        return result
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="startup_output.json", help="where to write the results")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="list the N slowest imports")
+    parser.add_argument("--prefork", type=int, default=0, metavar="N", help="also measure gunicorn with N workers")
+    parser.add_argument("--settle", type=float, default=60, help="seconds for workers to load their models")
+    opts = parser.parse_args(argv)
+
+    report = {
+        "meta": {"timestamp": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+                 "cpu_count": os.cpu_count()},
+        "import": measure_import(opts.repeat),
+    }
+    r = report["import"]
+    if "import_s" in r:
+        print(f"import app        {r['import_s']:.3f}s (first {r['first_import_s']:.3f}s), "
+              f"first response {r['first_response_s']:.3f}s, RSS {r['memory_mb'].get('rss', 0):.0f} MB, "
+              f"heavy modules: {', '.join(r['heavy_modules']) or 'none'}")
+    else:
+        print(f"import app        error: {r.get('error')}")
+
+    if opts.importtime:
+        report["slowest_imports"] = slowest_imports(opts.importtime)
+        for row in report["slowest_imports"]:
+            print(f"  {row['cumulative_s']:>8.3f}s  {row['module']}")
+
+    if opts.prefork:
+        report["prefork"] = []
+        for preload in (True, False):
+            r = measure_prefork(opts.prefork, preload, opts.settle)
+            report["prefork"].append(r)
+            label = f"gunicorn x{opts.prefork} {'preload' if preload else 'no preload':<10}"
+            if r["status"] != "ok":
+                print(f"{label} {r['status']}: {r.get('error')}")
+                continue
+            print(f"{label} up in {r['first_response_s']:.1f}s, total RSS {r['total_rss_mb']:.0f} MB, "
+                  f"total PSS {r['total_pss_mb']:.0f} MB")
+            for i, m in enumerate(r["worker_mb"]):
+                print(f"  worker {i}: RSS {m.get('rss', 0):.0f} MB, shared {m.get('shared', 0):.0f} MB, "
+                      f"private {m.get('private', 0):.0f} MB")
+
+    with open(opts.out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nwrote {opts.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Offline stand-ins for the external heavy stages, so the benchmarks run on a
+CPU-only machine without Demucs weights or a MuseScore install.
+"""
+import os
+import stat
+import sys
+
+import soundfile as sf
+
+STUB_MUSESCORE = '''#!{python}
+import json, sys
+PDF = b"%PDF-1.4\\n%%EOF\\n"
+args = sys.argv[1:]
+if args[0] == "-j":
+    for job in json.load(open(args[1])):
+        open(job["out"], "wb").write(PDF)
+else:
+    open(args[args.index("-o") + 1], "wb").write(PDF)
+'''
+
+
+def install_stub_musescore(bin_dir: str) -> str:
+    """Write a fake musescore3 that emits an empty PDF and point utils.midi_to_pdf at it."""
+    from utils import midi_to_pdf
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "musescore3")
+    with open(path, "w") as fh:
+        fh.write(STUB_MUSESCORE.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    midi_to_pdf.MUSESCORE_BIN = path
+    return path
+
+
+def stub_separate_file(filepath, out_dir, stems, ext="wav"):
+    """Stand-in for utils.separate.separate_file: every stem is a copy of the mix."""
+    y, sr = sf.read(filepath, dtype="float32", always_2d=True)
+    names = stems if len(stems) != 1 else [stems[0], f"no_{stems[0]}"]
+    written = []
+    for name in names:
+        path = os.path.join(out_dir, f"{name}.{ext}")
+        sf.write(path, y, sr)
+        written.append(path)
+    return written
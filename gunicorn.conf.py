@@ -0,0 +1,48 @@
+"""
+Pre-fork deployment of the web app:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+app.py is imported once in the master (preload_app). With PRELOAD_MODELS=1,
+the default, the master also loads Demucs before forking, so every worker
+shares the weights copy-on-write instead of holding a private copy; gc.freeze()
+keeps the garbage collector from dirtying those pages. basic-pitch is loaded by
+each worker after the fork, because TensorFlow does not survive one.
+
+Each worker runs its own job threads, scheduler slots and queue limit, so
+SEPARATE_SLOTS, TRANSCRIBE_SLOTS and MAX_PENDING_JOBS apply per worker. Job
+status is shared through JOB_STATE_DIR, so any worker can answer a status poll.
+Per-worker memory is exported on /metrics as process_memory_mb.
+"""
+import gc
+import os
+import threading
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_WORKERS", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 8))
+# uploads of long recordings take a while to arrive
+timeout = int(os.environ.get("WEB_TIMEOUT", 300))
+preload_app = True
+
+# outside static/: state files carry song names and error messages
+os.environ.setdefault("JOB_STATE_DIR", os.path.join("var", "jobs"))
+# app.py must not start its warm-up thread in the master; the hooks below take over
+os.environ["WARM_MODELS"] = "0"
+
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "1") == "1"
+
+
+def when_ready(server):
+    # the master, after importing app.py and before the first fork
+    if PRELOAD_MODELS:
+        from app import preload_models
+        preload_models()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if PRELOAD_MODELS:
+        from app import warm_default_models
+        threading.Thread(target=warm_default_models, daemon=True).start()
@@ -0,0 +1,51 @@
+"""
+/download/<result_id>.zip streams the archive: the response must not be buffered
+to compute a Content-Length, and a matching If-None-Match is answered with 304.
+"""
+import io
+import os
+import types
+import zipfile
+
+import pytest
+
+from utils.cache import ResultCache
+from utils.pipeline import META_FILE
+
+RESULT_ID = "a" * 64
+
+
+@pytest.fixture
+def flask_app(tmp_path, monkeypatch):
+    # app.py creates its folders relative to the working directory on import
+    monkeypatch.chdir(tmp_path)
+    import app
+
+    cache = ResultCache(str(tmp_path / "results"))
+    staging = cache.staging_dir("job")
+    os.makedirs(staging)
+    with open(f"{staging}/{META_FILE}", "w") as fh:
+        fh.write('{"song_name": "song"}')
+    with open(f"{staging}/drums.mid", "wb") as fh:
+        fh.write(b"MThd" + bytes(100))
+    cache.commit(staging, RESULT_ID)
+    monkeypatch.setattr(app, "cache", cache)
+    monkeypatch.setitem(app.app.config, "OUTPUT_BASE", str(tmp_path / "results"))
+    return app.app
+
+
+def test_zip_is_streamed(flask_app):
+    with flask_app.test_request_context(f"/download/{RESULT_ID}.zip"):
+        response = flask_app.full_dispatch_request()
+    assert response.status_code == 200
+    assert "Content-Length" not in response.headers
+    assert isinstance(response.response, types.GeneratorType)
+    with zipfile.ZipFile(io.BytesIO(b"".join(response.response))) as zf:
+        assert zf.namelist() == ["song/drums.mid"]
+
+
+def test_zip_not_modified(flask_app):
+    response = flask_app.test_client().get(f"/download/{RESULT_ID}.zip", headers={"If-None-Match": f'"{RESULT_ID}"'})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.headers["ETag"] == f'"{RESULT_ID}"'
@@ -0,0 +1,108 @@
+"""
+classify_onsets batches segments through one shared STFT; it must pick the same
+drum for every onset as the per-segment librosa loop it replaced.
+"""
+import warnings
+
+import librosa
+import numpy as np
+import pytest
+
+from utils.drum_transcribe import NORMALIZED_FILE, PCM_NAME, DrumAnalysis, classify_onsets, segment_features
+from utils.pcm import pcm_file
+
+SR = 44100
+HOP = 512
+
+
+def reference_types(y, sr, onset_frames, hop_length=HOP):
+    """The per-segment classification drum_transcribe.py used before batching."""
+    types = []
+    for frame in onset_frames:
+        start_sample = frame * hop_length
+        end_sample = min(len(y), start_sample + int(0.1 * sr))
+        if start_sample >= end_sample:
+            continue
+        segment = y[start_sample:end_sample]
+
+        spectral_centroid = librosa.feature.spectral_centroid(y=segment, sr=sr)[0].mean()
+        spectral_bandwidth = librosa.feature.spectral_bandwidth(y=segment, sr=sr)[0].mean()
+        rms = np.sqrt(np.mean(segment**2))
+        zero_crossing_rate = librosa.feature.zero_crossing_rate(y=segment)[0].mean()
+        mfccs = librosa.feature.mfcc(y=segment, sr=sr, n_mfcc=13)
+        mfcc1_mean = mfccs[0].mean() if mfccs.size else 0.0
+
+        if rms > 0.03 and spectral_centroid < 1200 and spectral_bandwidth < 1800 and mfcc1_mean > -150:
+            types.append(36)
+        elif zero_crossing_rate > 0.15 and spectral_centroid > 2500:
+            types.append(42)
+        elif rms > 0.03 and spectral_bandwidth > 2500 and zero_crossing_rate > 0.08:
+            types.append(38)
+        else:
+            types.append(36 if rms > 0.03 * 1.5 else 38)
+    return types
+
+
+@pytest.fixture
+def drum_loop():
+    """Four seconds of kick, snare and hi-hat hits on eighth notes at 120 BPM, normalized."""
+    rng = np.random.default_rng(0)
+    y = np.zeros(4 * SR, dtype=np.float64)
+    t = np.arange(int(0.15 * SR)) / SR
+    kick = np.sin(2 * np.pi * 55 * t) * np.exp(-t * 25)
+    snare = (0.6 * rng.standard_normal(len(t)) + 0.4 * np.sin(2 * np.pi * 190 * t)) * np.exp(-t * 35)
+    hat = 0.3 * np.diff(rng.standard_normal(len(t) + 1)) * np.exp(-t * 90)
+    for i in range(16):
+        start = i * SR // 4
+        hit = (kick, hat, snare, hat)[i % 4]
+        end = min(len(y), start + len(hit))
+        y[start:end] += hit[:end - start]
+    return librosa.util.normalize(y).astype(np.float32)
+
+
+def test_classify_onsets_matches_per_segment_loop(drum_loop):
+    frames = np.arange(0, len(drum_loop) // HOP, 7)
+    # the last onsets lie so close to the end that their segments are cut short
+    frames = np.append(frames, [len(drum_loop) // HOP - 3, len(drum_loop) // HOP - 1])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected = reference_types(drum_loop, SR, frames)
+        assert classify_onsets(drum_loop, SR, frames, HOP) == expected
+    assert {36, 38, 42} <= set(expected)
+
+
+def test_segment_features_match_librosa(drum_loop):
+    seg_len = int(0.1 * SR)
+    starts = np.arange(0, len(drum_loop) - seg_len, SR // 8)
+    segments = drum_loop[starts[:, None] + np.arange(seg_len)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        centroid, bandwidth, rms, zcr, mfcc1 = segment_features(segments, SR)
+        for i, segment in enumerate(segments):
+            np.testing.assert_allclose(
+                [centroid[i], bandwidth[i], rms[i], zcr[i], mfcc1[i]],
+                [librosa.feature.spectral_centroid(y=segment, sr=SR)[0].mean(),
+                 librosa.feature.spectral_bandwidth(y=segment, sr=SR)[0].mean(),
+                 np.sqrt(np.mean(segment**2)),
+                 librosa.feature.zero_crossing_rate(y=segment)[0].mean(),
+                 librosa.feature.mfcc(y=segment, sr=SR, n_mfcc=13)[0].mean()],
+                rtol=1e-6)
+
+
+def test_saved_analysis_classifies_like_fresh(drum_loop, tmp_path):
+    # silence around the loop, so trimming moves the frames
+    y = np.concatenate([np.zeros(SR // 2, dtype=np.float32), 0.5 * drum_loop, np.zeros(SR // 3, dtype=np.float32)])
+    frames = np.arange(0, (len(drum_loop) - SR // 10) // HOP, 5)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fresh = DrumAnalysis(y, SR)
+        fresh.drum_types(frames[::2])
+        fresh.save(tmp_path)
+
+        loaded = DrumAnalysis.load(tmp_path)
+        assert isinstance(loaded.y, np.memmap)
+        # every second frame was classified before saving; the rest is classified from the mapped stem
+        assert loaded.drum_types(frames)[1] == fresh.drum_types(frames)[1]
+    # only the trimmed region is stored
+    assert len(np.load(tmp_path / pcm_file("", PCM_NAME, SR))) == len(fresh.trimmed) < len(y)
+    assert not (tmp_path / NORMALIZED_FILE).exists()
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+STAGING_DIR = ".staging"
+MARKER_FILE = "meta.json"
+# in an entry some of whose stems failed; lookup misses it so the next upload redoes it
+INCOMPLETE_FILE = ".incomplete"
+
+
+def hash_audio(path: str, params: Dict[str, Any], chunk_size: int = 1 << 20) -> str:
+    """
+    Content address for a result: sha256 over the uploaded audio bytes plus the
+    processing parameters, so the same song processed differently gets its own entry.
+    """
+    return result_key(audio_hasher(path, chunk_size), params)
+
+
+def audio_hasher(path: str, chunk_size: int = 1 << 20):
+    """sha256 state after the audio bytes; result_key finishes it for any set of parameters."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h
+
+
+def result_key(hasher, params: Dict[str, Any]) -> str:
+    h = hasher.copy()
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def derived_key(key: str, params: Dict[str, Any]) -> str:
+    """Content address for a result derived from the entry `key` with `params`."""
+    h = hashlib.sha256(key.encode("utf-8"))
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """
+    Content-addressed store of finished results below `base_dir`.
+    An entry is a folder named after its key; it is complete once its meta.json
+    exists, and the mtime of that file is the entry's last access time. Jobs build
+    their output in a staging folder and `commit` moves it into place atomically.
+    An entry committed as incomplete can be shown and downloaded, but `lookup`
+    only finds it with `partial`, so it is not reused for new uploads.
+    """
+
+    def __init__(self, base_dir: str, max_bytes: int = 0, max_age: float = 0):
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(base_dir, STAGING_DIR), exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.base_dir, key)
+
+    def lookup(self, key: str, partial: bool = False) -> Optional[str]:
+        """
+        Return the entry folder for `key` if it is complete, marking it as used.
+        With `partial` an entry committed as incomplete is returned too.
+        """
+        marker = os.path.join(self.path(key), MARKER_FILE)
+        try:
+            os.utime(marker)
+        except OSError:
+            return None
+        if not partial and os.path.exists(os.path.join(self.path(key), INCOMPLETE_FILE)):
+            return None
+        return self.path(key)
+
+    def staging_dir(self, name: str) -> str:
+        return os.path.join(self.base_dir, STAGING_DIR, name)
+
+    def commit(self, staging: str, key: str, complete: bool = True) -> str:
+        """
+        Publish a finished staging folder as the entry for `key`. An incomplete one
+        (some stems failed) never replaces an existing entry; a complete one replaces
+        an incomplete entry.
+        """
+        final = self.path(key)
+        if not complete:
+            open(os.path.join(staging, INCOMPLETE_FILE), "w").close()
+        with self._lock:
+            if os.path.exists(os.path.join(final, MARKER_FILE)) and \
+                    (not complete or not os.path.exists(os.path.join(final, INCOMPLETE_FILE))):
+                # another job produced the same result first
+                shutil.rmtree(staging, ignore_errors=True)
+            else:
+                shutil.rmtree(final, ignore_errors=True)
+                os.replace(staging, final)
+        return final
+
+    def entries(self) -> List[Tuple[str, float, int]]:
+        """(key, last access, size in bytes) for every complete entry."""
+        out = []
+        for name in os.listdir(self.base_dir):
+            if name.startswith("."):
+                continue
+            marker = os.path.join(self.base_dir, name, MARKER_FILE)
+            try:
+                atime = os.path.getmtime(marker)
+            except OSError:
+                continue
+            out.append((name, atime, _dir_size(os.path.join(self.base_dir, name))))
+        return out
+
+    def evict(self) -> List[str]:
+        """
+        Drop entries older than max_age, then least recently used entries until the
+        cache fits in max_bytes. A limit of 0 disables that rule.
+        """
+        removed = []
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda e: e[1])
+            now = time.time()
+            total = sum(size for _, _, size in entries)
+            for key, atime, size in entries:
+                expired = self.max_age and now - atime > self.max_age
+                over_budget = self.max_bytes and total > self.max_bytes
+                if not (expired or over_budget):
+                    continue
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                total -= size
+                removed.append(key)
+        if removed:
+            print(f"[cache] evicted {len(removed)} entries")
+        return removed
@@ -0,0 +1,87 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class StageResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.status = None
+        self.value = None
+        self.error: Optional[BaseException] = None
+        self.duration = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == DONE
+
+
+class StageGraph:
+    """
+    A small DAG of pipeline stages for one job. A stage runs once all its
+    dependencies are done and receives their return values as positional
+    arguments. Independent stages run in parallel on `max_workers` threads.
+    A stage that raises fails alone: stages depending on it are skipped, every
+    other branch carries on. Results come back in the order the stages were
+    added, whatever order they finished in; when several stages are ready the
+    one added first starts first.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max(1, max_workers)
+        self._stages: Dict[str, Any] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._stages
+
+    def add(self, name: str, fn: Callable[..., Any], deps: Sequence[str] = ()) -> str:
+        """Add a stage; its dependencies must already be in the graph, which keeps it acyclic."""
+        if name in self._stages:
+            raise ValueError(f"duplicate stage {name}")
+        for d in deps:
+            if d not in self._stages:
+                raise ValueError(f"stage {name} depends on unknown stage {d}")
+        self._stages[name] = (fn, tuple(deps))
+        return name
+
+    def run(self) -> Dict[str, StageResult]:
+        results = {name: StageResult(name) for name in self._stages}
+        waiting: List[str] = list(self._stages)
+        running = {}
+        # stages run with a copy of the caller's context, e.g. its job trace
+        context = contextvars.copy_context()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as pool:
+            while waiting or running:
+                for name in list(waiting):
+                    fn, deps = self._stages[name]
+                    states = [results[d].status for d in deps]
+                    if any(s in (FAILED, SKIPPED) for s in states):
+                        results[name].status = SKIPPED
+                        waiting.remove(name)
+                    elif all(s == DONE for s in states) and len(running) < self.max_workers:
+                        args = [results[d].value for d in deps]
+                        running[pool.submit(context.copy().run, self._call, fn, args)] = name
+                        waiting.remove(name)
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = results[running.pop(future)]
+                    result.duration, result.value, result.error = future.result()
+                    result.status = FAILED if result.error is not None else DONE
+        return results
+
+    @staticmethod
+    def _call(fn, args):
+        start = time.perf_counter()
+        try:
+            value = fn(*args)
+        except Exception as e:
+            return time.perf_counter() - start, None, e
+        return time.perf_counter() - start, value, None
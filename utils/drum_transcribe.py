@@ -1,49 +1,305 @@
 import os
+import tempfile
 from pathlib import Path
 import numpy as np
 import librosa
 import mido
 import math
-import shutil
+from .metrics import span
+from .pcm import open_pcm, store_pcm
+from .midi_events import NoteEvents
 
+# created on first use by extract_midi, not at import
 OUTPUT_DIR = Path("output")
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+# a saved DrumAnalysis, see DrumAnalysis.save; the trimmed stem is the "drums" entry of utils/pcm.py
+ANALYSIS_FILE = "drums_analysis.npz"
+PCM_NAME = "drums"
+# the normalized signal as analyses saved before the PCM entry kept it; still read
+NORMALIZED_FILE = "drums_normalized.npy"
 
 def quantize_midi_file(input_path, output_path, bpm, subdivision=4):
     mid = mido.MidiFile(input_path)
     new_mid = mido.MidiFile()
     new_mid.ticks_per_beat = mid.ticks_per_beat
+    resolution_ticks = max(1, mid.ticks_per_beat // subdivision)
 
     for track in mid.tracks:
-        new_track = mido.MidiTrack()
-        current_time = 0
-        events = []
-        # convert to absolute times
-        abs_time = 0
-        for msg in track:
-            abs_time += msg.time
-            events.append((abs_time, msg.copy()))
-
-        # quantize note_on/note_off absolute times
-        resolution_ticks = max(1, mid.ticks_per_beat // subdivision)
-        for i, (t, msg) in enumerate(events):
-            if msg.type in ['note_on', 'note_off']:
-                q = round(t / resolution_ticks) * resolution_ticks
-                events[i] = (int(q), msg)
-
-        # sort and convert back to delta
-        events.sort(key=lambda x: x[0])
-        last = 0
-        for t, msg in events:
-            delta = int(max(0, t - last))
-            last = t
-            m = msg.copy()
-            m.time = delta
-            new_track.append(m)
-        new_mid.tracks.append(new_track)
+        # absolute times, with note_on/note_off snapped to the grid
+        abs_time = np.cumsum([msg.time for msg in track], dtype=np.int64)
+        is_note = np.array([msg.type in ('note_on', 'note_off') for msg in track], dtype=bool)
+        snapped = np.round(abs_time / resolution_ticks).astype(np.int64) * resolution_ticks
+        times = np.where(is_note, snapped, abs_time)
+
+        # stable sort and convert back to delta
+        order = np.argsort(times, kind='stable')
+        deltas = np.maximum(0, np.diff(times[order], prepend=0))
+        new_mid.tracks.append(mido.MidiTrack(
+            track[i].copy(time=int(d)) for i, d in zip(order.tolist(), deltas.tolist())
+        ))
 
     new_mid.save(output_path)
 
+# drum-hit classification rules, applied to a short segment after every onset
+SEGMENT_DURATION = 0.1
+CLASSIFY_BATCH = 256
+N_MFCC = 13
+
+KICK_RMS_THRESH = 0.03
+KICK_SPEC_CENT_THRESH = 1200
+KICK_SPEC_BW_THRESH = 1800
+KICK_MFCC1_THRESH = -150
+
+SNARE_RMS_THRESH = 0.03
+SNARE_SPEC_BW_THRESH = 2500
+SNARE_ZCR_THRESH = 0.08
+
+HAT_SPEC_CENT_THRESH = 2500
+HAT_ZCR_THRESH = 0.15
+
+
+def segment_features(segments, sr, n_mfcc=N_MFCC):
+    """
+    Features for a batch of equal-length segments, shape (n, samples).
+    One STFT is shared by centroid, bandwidth and MFCC; every reduction stays within
+    a segment, so row i matches what the per-segment librosa calls return for segments[i].
+    Returns (spectral_centroid, spectral_bandwidth, rms, zero_crossing_rate, mfcc1) means.
+    """
+    S = np.abs(librosa.stft(segments, n_fft=2048, hop_length=512))
+    centroid = librosa.feature.spectral_centroid(S=S, sr=sr)[:, 0].mean(axis=-1)
+    bandwidth = librosa.feature.spectral_bandwidth(S=S, sr=sr)[:, 0].mean(axis=-1)
+    rms = np.sqrt(np.mean(segments**2, axis=-1))
+    zcr = librosa.feature.zero_crossing_rate(y=segments)[:, 0].mean(axis=-1)
+
+    # power_to_db clips to top_db below the maximum; take that maximum per segment
+    mel = librosa.feature.melspectrogram(S=S**2, sr=sr)
+    log_mel = 10.0 * np.log10(np.maximum(1e-10, mel))
+    log_mel = np.maximum(log_mel, log_mel.max(axis=(-2, -1), keepdims=True) - 80.0)
+    mfccs = librosa.feature.mfcc(S=log_mel, n_mfcc=n_mfcc)
+    mfcc1 = mfccs[:, 0].mean(axis=-1) if mfccs.size else np.zeros(len(segments))
+    return centroid, bandwidth, rms, zcr, mfcc1
+
+
+def classify_features(centroid, bandwidth, rms, zcr, mfcc1):
+    """Map segment features to GM drum notes (36 kick, 38 snare, 42 closed hat)."""
+    kick = ((rms > KICK_RMS_THRESH) & (centroid < KICK_SPEC_CENT_THRESH) &
+            (bandwidth < KICK_SPEC_BW_THRESH) & (mfcc1 > KICK_MFCC1_THRESH))
+    hat = (zcr > HAT_ZCR_THRESH) & (centroid > HAT_SPEC_CENT_THRESH)
+    snare = (rms > SNARE_RMS_THRESH) & (bandwidth > SNARE_SPEC_BW_THRESH) & (zcr > SNARE_ZCR_THRESH)
+    fallback = np.where(rms > KICK_RMS_THRESH * 1.5, 36, 38)
+    return np.select([kick, hat, snare], [36, 42, 38], default=fallback)
+
+
+def normalize_segments(segments, peak):
+    """Segments of a signal divided by its peak exactly as librosa.util.normalize divides the whole signal."""
+    return np.divide(segments, peak, dtype=np.float64).astype(segments.dtype)
+
+
+def classify_onsets(y, sr, onset_frames, hop_length=512, peak=None):
+    """
+    Drum note for every onset whose segment lies inside `y`.
+    Full-length segments are gathered into (batch, samples) arrays and classified
+    CLASSIFY_BATCH at a time; the few segments cut short by the end of the signal
+    are classified on their own. With `peak`, `y` is not normalized yet and only the
+    gathered segments are, so a memory-mapped `y` is never copied whole.
+    """
+    with span("drum.classify", onsets=len(onset_frames)):
+        seg_len = int(SEGMENT_DURATION * sr)
+        starts = np.asarray(onset_frames, dtype=np.int64) * hop_length
+        starts = starts[starts < len(y)]
+        types = np.zeros(len(starts), dtype=np.int64)
+
+        full = np.flatnonzero(starts + seg_len <= len(y))
+        offsets = np.arange(seg_len)
+        for b in range(0, len(full), CLASSIFY_BATCH):
+            idx = full[b:b + CLASSIFY_BATCH]
+            segments = y[starts[idx, None] + offsets]
+            if peak is not None:
+                segments = normalize_segments(segments, peak)
+            types[idx] = classify_features(*segment_features(segments, sr))
+
+        for i in np.flatnonzero(starts + seg_len > len(y)):
+            segment = np.asarray(y[starts[i]:][None, :])
+            if peak is not None:
+                segment = normalize_segments(segment, peak)
+            types[i] = classify_features(*segment_features(segment, sr))[0]
+
+    return types.tolist()
+
+
+class DrumAnalysis:
+    """
+    A decoded drum stem and the DSP that tempo detection and onset extraction share.
+    The file is decoded and trimmed once; the percussive component, the onset-strength
+    envelope and the tempo are computed on first use and reused by both stages, and
+    every onset frame is classified only once.
+    """
+
+    def __init__(self, y, sr, hop_length=512, source=None):
+        self.y = y
+        self.sr = sr
+        self.hop_length = hop_length
+        self.source = source
+        self.trimmed, self.trim_index = librosa.effects.trim(y)
+        self.y_normalized = librosa.util.normalize(self.trimmed)
+        self._peak = None
+        self._percussive = None
+        self._onset_env = None
+        self._tempo = None
+        self._types = {}
+
+    @classmethod
+    def from_file(cls, audio_file, hop_length=512):
+        with span("drum.decode") as sp:
+            y, sr = librosa.load(audio_file, sr=None, mono=True)
+            sp.audio_seconds = len(y) / sr
+        return cls(y, sr, hop_length=hop_length, source=str(audio_file))
+
+    @property
+    def percussive(self):
+        if self._percussive is None:
+            with span("drum.hpss", audio_seconds=len(self.y_normalized) / self.sr):
+                self._percussive = librosa.effects.percussive(self.y_normalized)
+        return self._percussive
+
+    @property
+    def onset_env(self):
+        if self._onset_env is None:
+            percussive = self.percussive
+            with span("drum.onset_strength"):
+                self._onset_env = librosa.onset.onset_strength(
+                    y=percussive,
+                    sr=self.sr,
+                    hop_length=self.hop_length,
+                    aggregate=np.median
+                )
+        return self._onset_env
+
+    def onsets(self, sensitivity):
+        """Onset frames (relative to the trimmed signal); lower sensitivity => more onsets."""
+        wait_time = 0.04
+        delta_time = sensitivity
+        pre_avg_time = 0.1
+        pre_max_time = 0.03
+
+        wait_frames = max(0, int(wait_time * self.sr / self.hop_length))
+        pre_avg_frames = max(0, int(pre_avg_time * self.sr / self.hop_length))
+        pre_max_frames = max(0, int(pre_max_time * self.sr / self.hop_length))
+
+        onset_env = self.onset_env
+        with span("drum.onsets", sensitivity=sensitivity):
+            return librosa.onset.onset_detect(
+                onset_envelope=onset_env,
+                sr=self.sr,
+                hop_length=self.hop_length,
+                backtrack=True,
+                units='frames',
+                wait=wait_frames,
+                delta=delta_time,
+                pre_avg=pre_avg_frames,
+                post_avg=1,
+                pre_max=pre_max_frames,
+                post_max=1
+            )
+
+    def tempo(self):
+        if self._tempo is None:
+            onset_env = self.onset_env
+            with span("drum.tempo"):
+                tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=self.sr, hop_length=self.hop_length)
+            self._tempo = float(np.atleast_1d(tempo)[0])
+        return self._tempo
+
+    def drum_types(self, onset_frames):
+        """
+        (frames, drum notes) for the onset frames that lie inside the signal.
+        Frames classified before are looked up, only new ones are classified.
+        """
+        frames = np.asarray(onset_frames, dtype=np.int64)
+        frames = frames[frames * self.hop_length < len(self.trimmed)]
+        new = np.array([f for f in frames.tolist() if f not in self._types], dtype=np.int64)
+        if len(new):
+            if self.y_normalized is not None:
+                types = classify_onsets(self.y_normalized, self.sr, new, self.hop_length)
+            else:
+                # loaded: only the segments of the memory-mapped stem are read and normalized
+                types = classify_onsets(self.trimmed, self.sr, new, self.hop_length, peak=self.peak)
+            self._types.update(zip(new.tolist(), types))
+        return frames, [self._types[f] for f in frames.tolist()]
+
+    def save(self, directory):
+        """
+        Persist what onset picking, tempo and classification work from, so the drums can
+        be re-derived with other settings without decoding or HPSS: the onset-strength
+        envelope, the tempo, the types classified so far, and the trimmed stem (the
+        "drums" PCM entry, written once; onset frames never reach the cut silence) with
+        the peak that normalizes it for frames a new sensitivity turns up.
+        """
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(os.path.join(directory, NORMALIZED_FILE)):
+            store_pcm(directory, PCM_NAME, self.trimmed, self.sr)
+        frames = sorted(self._types)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            np.savez(fh, onset_env=self.onset_env, sr=self.sr, hop_length=self.hop_length,
+                     trim_index=np.asarray(self.trim_index), peak=self.peak,
+                     tempo=np.nan if self._tempo is None else self._tempo,
+                     frames=np.asarray(frames, dtype=np.int64),
+                     types=np.asarray([self._types[f] for f in frames], dtype=np.int64))
+        os.replace(tmp, os.path.join(directory, ANALYSIS_FILE))
+
+    @property
+    def peak(self):
+        """What librosa.util.normalize divided the trimmed signal by."""
+        if self._peak is None:
+            peak = float(np.max(np.abs(self.trimmed))) if len(self.trimmed) else 0.0
+            self._peak = peak if peak >= np.finfo(np.float32).tiny else 1.0
+        return self._peak
+
+    @classmethod
+    def load(cls, directory):
+        """
+        An analysis written by `save`. The trimmed stem is memory-mapped; segments are
+        normalized as they are classified.
+        """
+        analysis = cls.__new__(cls)
+        with np.load(os.path.join(directory, ANALYSIS_FILE)) as state:
+            analysis.sr = int(state["sr"])
+            analysis.hop_length = int(state["hop_length"])
+            analysis.trim_index = state["trim_index"]
+            analysis._onset_env = state["onset_env"]
+            tempo = float(state["tempo"])
+            analysis._types = dict(zip(state["frames"].tolist(), state["types"].tolist()))
+            peak = float(state["peak"]) if "peak" in state.files else 1.0
+        analysis._tempo = None if math.isnan(tempo) else tempo
+        legacy = os.path.join(directory, NORMALIZED_FILE)
+        if os.path.exists(legacy):
+            # saved before the PCM entry: already trimmed and normalized
+            analysis.y = analysis.trimmed = np.load(legacy, mmap_mode="r")
+            peak = 1.0
+        else:
+            analysis.y = analysis.trimmed = open_pcm(directory, PCM_NAME, analysis.sr)
+            if analysis.y is None:
+                raise FileNotFoundError(f"no decoded drum stem in {directory}")
+        analysis.y_normalized = None
+        analysis._peak = peak
+        analysis.source = directory
+        analysis._percussive = None
+        return analysis
+
+
+def as_analysis(audio):
+    """Accept a path or an existing DrumAnalysis."""
+    return audio if isinstance(audio, DrumAnalysis) else DrumAnalysis.from_file(audio)
+
+
+def parse_groove(groove):
+    times = groove.split('/')
+    nom = int(times[0]) if len(times) > 0 else 4
+    denom = int(times[1]) if len(times) > 1 else 4
+    return nom, denom
+
+
 class DrumBeatExtractor:
     def __init__(self):
         self.y = None
@@ -53,9 +309,7 @@ class DrumBeatExtractor:
 
     def detect_tempo(self, audio_file):
         try:
-            y, sr = librosa.load(audio_file, sr=None, mono=True)
-            yt, index = librosa.effects.trim(y)
-            tempo, _ = librosa.beat.beat_track(y=yt, sr=sr, units="time")
+            tempo = as_analysis(audio_file).tempo()
             tempo_int = int(tempo) if tempo and not math.isnan(tempo) else 120
             print(f"Detected tempo: {tempo_int} BPM")
             return max(20, tempo_int)
@@ -63,152 +317,43 @@ class DrumBeatExtractor:
             print(f"Error detecting tempo: {e}")
             return 120
 
-    def extract_midi(self, audio_file, tempo, sensitivity, groove, quantize, web):
-        times = groove.split('/')
-        nom = int(times[0]) if len(times) > 0 else 4
-        denom = int(times[1]) if len(times) > 1 else 4
-
+    def extract_events(self, audio_file, tempo, sensitivity):
+        """Detect and classify drum hits; returns NoteEvents at `tempo`, or None on failure."""
         try:
-            process_dir = OUTPUT_DIR / str(hash(audio_file))
-            process_dir.mkdir(parents=True, exist_ok=True)
-            out_folder_path = Path("output")
-            out_folder_path.mkdir(parents=True, exist_ok=True)
-
-            self.y, self.sr = librosa.load(audio_file, sr=None, mono=True)
-            yt, index = librosa.effects.trim(self.y)
-            y_normalized = librosa.util.normalize(yt)
-
-            y_percussive = librosa.effects.percussive(y_normalized)
-
-            hop_length = 512
-            onset_env = librosa.onset.onset_strength(
-                y=y_percussive,
-                sr=self.sr,
-                hop_length=hop_length,
-                aggregate=np.median
-            )
-
-            wait_time = 0.04
-            delta_time = sensitivity
-            pre_avg_time = 0.1
-            pre_max_time = 0.03
-
-            wait_frames = max(0, int(wait_time * self.sr / hop_length))
-            pre_avg_frames = max(0, int(pre_avg_time * self.sr / hop_length))
-            pre_max_frames = max(0, int(pre_max_time * self.sr / hop_length))
+            analysis = as_analysis(audio_file)
+            self.y, self.sr = analysis.y, analysis.sr
+            hop_length = analysis.hop_length
 
-            self.onset_frames = librosa.onset.onset_detect(
-                onset_envelope=onset_env,
-                sr=self.sr,
-                hop_length=hop_length,
-                backtrack=True,
-                units='frames',
-                wait=wait_frames,
-                delta=delta_time,
-                pre_avg=pre_avg_frames,
-                post_avg=1,
-                pre_max=pre_max_frames,
-                post_max=1
-            )
+            # onsets past the end of the signal get no type and are dropped
+            self.onset_frames, self.drum_types = analysis.drum_types(analysis.onsets(sensitivity))
 
             onset_times = librosa.frames_to_time(self.onset_frames, sr=self.sr, hop_length=hop_length)
-
-            self.drum_types = []
-            n_mfcc = 13
-
-            for i, frame in enumerate(self.onset_frames):
-                start_sample = frame * hop_length
-                segment_duration = 0.1
-                end_sample = min(len(y_normalized), start_sample + int(segment_duration * self.sr))
-                if start_sample >= end_sample:
-                    continue
-
-                segment = y_normalized[start_sample:end_sample]
-                if len(segment) == 0:
-                    continue
-
-                spectral_centroid = librosa.feature.spectral_centroid(y=segment, sr=self.sr)[0].mean()
-                spectral_bandwidth = librosa.feature.spectral_bandwidth(y=segment, sr=self.sr)[0].mean()
-                rms = np.sqrt(np.mean(segment**2))
-                zero_crossing_rate = librosa.feature.zero_crossing_rate(y=segment)[0].mean()
-                mfccs = librosa.feature.mfcc(y=segment, sr=self.sr, n_mfcc=n_mfcc)
-                mfcc1_mean = mfccs[0].mean() if mfccs.size else 0.0
-
-                kick_rms_thresh = 0.03
-                kick_spec_cent_thresh = 1200
-                kick_spec_bw_thresh = 1800
-                kick_mfcc1_thresh = -150
-
-                snare_rms_thresh = 0.03
-                snare_spec_bw_thresh = 2500
-                snare_zcr_thresh = 0.08
-
-                hat_spec_cent_thresh = 2500
-                hat_zcr_thresh = 0.15
-
-                if (rms > kick_rms_thresh and
-                    spectral_centroid < kick_spec_cent_thresh and
-                    spectral_bandwidth < kick_spec_bw_thresh and
-                    mfcc1_mean > kick_mfcc1_thresh):
-                    drum_type = 36
-                elif (zero_crossing_rate > hat_zcr_thresh and
-                      spectral_centroid > hat_spec_cent_thresh):
-                    drum_type = 42
-                elif (rms > snare_rms_thresh and
-                      spectral_bandwidth > snare_spec_bw_thresh and
-                      zero_crossing_rate > snare_zcr_thresh):
-                    drum_type = 38
-                else:
-                    if rms > kick_rms_thresh * 1.5:
-                        drum_type = 36
-                    else:
-                        drum_type = 38
-
-                self.drum_types.append(drum_type)
+            return NoteEvents.from_seconds(onset_times, self.drum_types, tempo)
 
         except Exception as e:
             print(f"Error analyzing audio: {e}")
             return None
 
-        try:
-            mid = mido.MidiFile()
-            track = mido.MidiTrack()
-            mid.tracks.append(track)
-
-            tempo_in_microseconds = mido.bpm2tempo(tempo)
-            track.append(mido.MetaMessage('set_tempo', tempo=tempo_in_microseconds))
-            track.append(mido.MetaMessage('time_signature', numerator=nom, denominator=denom))
-
-            ticks_per_beat = mid.ticks_per_beat
-            seconds_per_tick = 60.0 / (tempo * ticks_per_beat)
-
-            onset_times = librosa.frames_to_time(self.onset_frames, sr=self.sr, hop_length=hop_length)
-
-            last_tick = 0
-            for i, onset_time in enumerate(onset_times):
-                tick = int(onset_time / seconds_per_tick)
-                delta_time = tick - last_tick
-                last_tick = tick
+    def extract_midi(self, audio_file, tempo, sensitivity, groove, quantize, web, midi_path=None):
+        nom, denom = parse_groove(groove)
 
-                if i < len(self.drum_types):
-                    note = self.drum_types[i]
-                    track.append(mido.Message('note_on', note=note, velocity=100, time=delta_time, channel=9))
-                    track.append(mido.Message('note_off', note=note, velocity=0, time=10, channel=9))
+        events = self.extract_events(audio_file, tempo, sensitivity)
+        if events is None:
+            return None
 
-            if web:
-                midi_path = process_dir / "drums.mid"
-            else:
-                midi_path = out_folder_path / "drums.mid"
+        try:
+            if midi_path is None:
+                source = audio_file.source if isinstance(audio_file, DrumAnalysis) else audio_file
+                if web:
+                    midi_path = OUTPUT_DIR / str(hash(source)) / "drums.mid"
+                else:
+                    midi_path = Path("output") / "drums.mid"
 
             midi_path = Path(midi_path)
             midi_path.parent.mkdir(parents=True, exist_ok=True)
-            mid.save(str(midi_path))
-
             if quantize:
-                tmp = midi_path.with_suffix('.quant_tmp.mid')
-                quantize_midi_file(str(midi_path), str(tmp), bpm=tempo, subdivision=4)
-                shutil.move(str(tmp), str(midi_path))
-
+                events = events.quantize(subdivision=4)
+            events.save(midi_path, tempo=tempo, numerator=nom, denominator=denom)
             return str(midi_path)
 
         except Exception as e:
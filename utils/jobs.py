@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import METRICS, Trace, tracing
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# assumed job duration until one has finished, for Retry-After estimates
+DEFAULT_JOB_SECONDS = 60.0
+
+
+class QueueFull(Exception):
+    """Raised by JobManager.create when max_pending jobs are already queued or running."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    State of one background processing job.
+    The worker updates `stage`/`detail` as it moves through the pipeline so the
+    status endpoint can report progress while the request thread is long gone.
+    `trace` collects the timing spans of every stage the job runs. With
+    `state_path` every change is also written there, for other server processes.
+    """
+
+    def __init__(self, job_id: str, song_name: str, trace: Optional[Trace] = None,
+                 state_path: Optional[str] = None):
+        self.id = job_id
+        self.song_name = song_name
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.detail = None
+        self.error = None
+        self.result_id = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.trace = trace if trace is not None else Trace(job_id)
+        self.trace.id = job_id
+        self.state_path = state_path
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str, detail: Optional[str] = None):
+        with self._lock:
+            self.stage = stage
+            self.detail = detail
+        self.save_state()
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        tmp = f"{self.state_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w") as fh:
+                json.dump(self.to_dict(), fh)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            # status polls served by other processes go stale, the job itself carries on
+            print(f"[jobs] could not save state of job {self.id}: {e}")
+
+    def mark_done(self, result_id: str):
+        self.result_id = result_id
+        self.status = DONE
+        self.finished_at = time.time()
+        self.set_stage(DONE)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "song_name": self.song_name,
+                "status": self.status,
+                "stage": self.stage,
+                "detail": self.detail,
+                "error": self.error,
+                "result_id": self.result_id,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """
+    Runs pipeline jobs on a bounded thread pool.
+    `submit` returns immediately; the callable receives the Job as its first
+    argument and must return the result id the job produced. With `max_pending`
+    set, `create` refuses new jobs once that many are queued or running.
+
+    Jobs live in the process that created them. When several server processes
+    share the work (pre-fork), `state_dir` lets `status` answer for jobs of the
+    other processes from the state files every job keeps there.
+    """
+
+    def __init__(self, max_workers: int = 2, max_records: int = 1000, max_pending: int = 0,
+                 state_dir: Optional[str] = None):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max_pending
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._max_records = max_records
+        self._avg_seconds = None
+        METRICS.add_collector(self._collect)
+
+    def create(self, song_name: str, trace: Optional[Trace] = None) -> Job:
+        """Register a new queued job without starting it; `trace` may already hold request-side spans."""
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, song_name, trace, self._state_path(job_id))
+        with self._lock:
+            if self.max_pending and self._pending() >= self.max_pending:
+                raise QueueFull(self._retry_after())
+            self._jobs[job.id] = job
+            self._prune()
+        job.save_state()
+        return job
+
+    def start(self, job: Job, fn: Callable[..., str], *args, **kwargs) -> Job:
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def submit(self, song_name: str, fn: Callable[..., str], *args, **kwargs) -> Job:
+        return self.start(self.create(song_name), fn, *args, **kwargs)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job.to_dict of a job of this process, or else the last state another process saved."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        path = self._state_path(job_id)
+        if path is None or not job_id.isalnum():
+            return None
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _state_path(self, job_id: str) -> Optional[str]:
+        return os.path.join(self.state_dir, f"{job_id}.json") if self.state_dir else None
+
+    def full(self) -> bool:
+        with self._lock:
+            return bool(self.max_pending) and self._pending() >= self.max_pending
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return self._retry_after()
+
+    def _pending(self) -> int:
+        return sum(1 for j in self._jobs.values() if not j.finished)
+
+    def _retry_after(self) -> int:
+        # time until a worker frees up for the job after the current backlog
+        avg = self._avg_seconds or DEFAULT_JOB_SECONDS
+        waves = max(1, self._pending() - self.max_workers + 1) / self.max_workers
+        return int(min(600, max(1, math.ceil(avg * waves))))
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {QUEUED: 0, RUNNING: 0}
+        for j in jobs:
+            if j.status in counts:
+                counts[j.status] += 1
+        return counts
+
+    def _collect(self):
+        for status, n in self.counts().items():
+            yield "jobs_inflight", "gauge", "Jobs queued or running.", {"status": status}, n
+
+    def _run(self, job: Job, fn, args, kwargs):
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.save_state()
+        METRICS.observe("job_queue_seconds", job.started_at - job.created_at)
+        try:
+            with tracing(job.trace):
+                result_id = fn(job, *args, **kwargs)
+            job.mark_done(result_id)
+        except Exception as e:
+            print(f"[jobs] job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+            job.finished_at = time.time()
+            job.set_stage(FAILED)
+        duration = job.finished_at - job.started_at
+        METRICS.observe("job_duration_seconds", duration)
+        with self._lock:
+            self._avg_seconds = duration if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * duration
+        METRICS.inc("jobs_total", status=job.status)
+
+    def _prune(self):
+        # forget the oldest finished jobs once the table grows past max_records
+        if len(self._jobs) <= self._max_records:
+            return
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.created_at)
+        for j in finished[: len(self._jobs) - self._max_records]:
+            del self._jobs[j.id]
+            if j.state_path:
+                try:
+                    os.remove(j.state_path)
+                except OSError:
+                    pass
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
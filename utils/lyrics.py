@@ -0,0 +1,214 @@
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+DEADLINE = 12.0  # seconds for a whole lookup, all providers together
+CACHE_TTL = 24 * 3600
+NEGATIVE_TTL = 3600
+CACHE_SIZE = 2048
+
+
+def clean_string(s):
+    return re.sub(r"[^a-zA-Z0-9 ]", "", s).lower().strip()
+
+
+def cache_key(artist: str, title: str) -> Tuple[str, str]:
+    return (" ".join(clean_string(artist).split()), " ".join(clean_string(title).split()))
+
+
+class Cancelled(Exception):
+    pass
+
+
+class ProviderError(Exception):
+    """A provider answered with something other than the lyrics or a clear "not found"."""
+
+
+# what LyricsService._fetch returns for a provider that failed; unlike None it is no answer at all
+FAILED = object()
+
+
+def check_status(r):
+    """True for 200, False for 404 (not found); any other status raises ProviderError."""
+    if r.status_code == 200:
+        return True
+    if r.status_code == 404:
+        return False
+    raise ProviderError(f"HTTP {r.status_code} from {r.url}")
+
+
+class LyricsProvider(ABC):
+    """
+    One lyrics source. `fetch` returns the lyrics, or None when the source
+    definitely has none; errors and unexpected answers raise instead, so they are
+    not cached as a miss. It receives the shared session, the time it may still
+    spend, and an event that is set once another provider has won so
+    multi-request providers can stop early.
+    """
+
+    name = "provider"
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    @abstractmethod
+    def fetch(self, session: requests.Session, artist: str, title: str,
+              deadline: float, cancelled: threading.Event) -> Optional[str]:
+        ...
+
+    @staticmethod
+    def _get(session, url, deadline, cancelled, **kwargs):
+        remaining = deadline - time.monotonic()
+        if cancelled.is_set() or remaining <= 0:
+            raise Cancelled()
+        return session.get(url, timeout=remaining, **kwargs)
+
+
+class AZLyricsProvider(LyricsProvider):
+    name = "azlyrics"
+
+    def __init__(self, base_url: str = "https://www.azlyrics.com"):
+        super().__init__(base_url)
+
+    def fetch(self, session, artist, title, deadline, cancelled):
+        artist_clean = clean_string(artist).replace(" ", "")
+        title_clean = clean_string(title).replace(" ", "")
+        r = self._get(session, f"{self.base_url}/lyrics/{artist_clean}/{title_clean}.html", deadline, cancelled)
+        if not check_status(r):
+            return None
+
+        soup = BeautifulSoup(r.text, "html.parser")
+
+        # lyrics live inside the first large <div> after comments
+        for div in soup.find_all("div"):
+            if div.get("class") is None and div.get("id") is None:
+                text = div.get_text("\n").strip()
+                if len(text.split()) > 20:
+                    return text
+        return None
+
+
+class GeniusProvider(LyricsProvider):
+    name = "genius"
+
+    def __init__(self, base_url: str = "https://genius.com"):
+        super().__init__(base_url)
+
+    def fetch(self, session, artist, title, deadline, cancelled):
+        r = self._get(session, f"{self.base_url}/api/search/song", deadline, cancelled,
+                      params={"q": f"{artist} {title}"})
+        if not check_status(r):
+            return None
+        hits = r.json()["response"]["sections"][0]["hits"]
+        if not hits:
+            return None
+
+        page = self._get(session, hits[0]["result"]["url"], deadline, cancelled)
+        if not check_status(page):
+            return None
+        soup = BeautifulSoup(page.text, "html.parser")
+
+        lyrics_divs = soup.find_all("div", {"data-lyrics-container": "true"})
+        if not lyrics_divs:
+            return None
+
+        lyrics = "\n".join([d.get_text("\n") for d in lyrics_divs])
+        return lyrics.strip()
+
+
+class LyricsService:
+    """
+    Looks lyrics up from all providers at once over one pooled HTTP session.
+    The first provider with an answer wins and the rest are told to stop; the
+    whole lookup is bounded by `deadline`. Answers are cached per normalized
+    (artist, title) for `ttl` seconds, and misses for `negative_ttl` seconds
+    when every provider said "not found"; a lookup where a provider failed or
+    ran out of time is not cached.
+    """
+
+    def __init__(self, providers: Optional[List[LyricsProvider]] = None, deadline: float = DEADLINE,
+                 ttl: float = CACHE_TTL, negative_ttl: float = NEGATIVE_TTL, cache_size: int = CACHE_SIZE,
+                 max_workers: int = 8):
+        self.providers = providers if providers is not None else [AZLyricsProvider(), GeniusProvider()]
+        self.deadline = deadline
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_size = cache_size
+        self._cache: Dict[Tuple[str, str], Tuple[float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lyrics")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.providers) * 2, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "Mozilla/5.0 (music-transcriber-app)"
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return False, None
+            expires, lyrics = entry
+            if expires < time.monotonic():
+                del self._cache[key]
+                return False, None
+            return True, lyrics
+
+    def _store(self, key, lyrics):
+        ttl = self.ttl if lyrics else self.negative_ttl
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                # drop the entry closest to expiry
+                del self._cache[min(self._cache, key=lambda k: self._cache[k][0])]
+            self._cache[key] = (time.monotonic() + ttl, lyrics)
+
+    def _fetch(self, provider, artist, title, deadline, cancelled):
+        """The provider's answer, or FAILED if it raised or was stopped."""
+        try:
+            return provider.fetch(self.session, artist, title, deadline, cancelled)
+        except Cancelled:
+            return FAILED
+        except Exception as e:
+            print(f"[lyrics] {provider.name} failed: {e}")
+            return FAILED
+
+    def lookup(self, artist: str, title: str) -> Optional[str]:
+        key = cache_key(artist, title)
+        hit, lyrics = self._cached(key)
+        if hit:
+            return lyrics
+
+        deadline = time.monotonic() + self.deadline
+        cancelled = threading.Event()
+        pending = {self._executor.submit(self._fetch, p, artist, title, deadline, cancelled) for p in self.providers}
+        failed = False
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # out of time: not a definitive miss, so nothing is cached
+                    return None
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    lyrics = future.result()
+                    if lyrics is FAILED:
+                        failed = True
+                    elif lyrics:
+                        self._store(key, lyrics)
+                        return lyrics
+        finally:
+            cancelled.set()
+            for future in pending:
+                future.cancel()
+
+        if not failed:
+            self._store(key, None)
+        return None
@@ -0,0 +1,331 @@
+import contextvars
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# how often the RSS of the process is sampled while spans are open
+RSS_SAMPLE_INTERVAL = 0.05
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    """
+    Counters, gauges and histograms keyed by name and labels, rendered in the
+    Prometheus text exposition format. Collectors are called at scrape time for
+    values that are cheaper to read than to keep up to date.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._values: Dict[str, Dict[LabelKey, Any]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        with self._lock:
+            self._meta[name] = (kind, help_text)
+            self._values.setdefault(name, {})
+            if kind == "histogram":
+                self._buckets[name] = tuple(sorted(buckets))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            key = _key(labels)
+            series[key] = series.get(key, 0) + value
+
+    # gauges change in both directions with the same call
+    add = inc
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values.setdefault(name, {})[_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            buckets = self._buckets.get(name, DURATION_BUCKETS)
+            series = self._values.setdefault(name, {})
+            key = _key(labels)
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def add_collector(self, fn: Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]):
+        """`fn` yields (name, kind, help, labels, value) whenever the metrics are scraped."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                kind, help_text = self._meta.get(name, ("untyped", ""))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self._values[name].items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+                        continue
+                    counts, total, count = value
+                    for bound, n in zip(self._buckets[name], counts):
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {n}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        described = set()
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                if name not in described:
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    described.add(name)
+                lines.append(f"{name}{_format_labels(_key(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Registry()
+METRICS.describe("stage_duration_seconds", "histogram", "Wall time of a pipeline stage.")
+METRICS.describe("stage_audio_seconds_total", "counter", "Seconds of audio processed by a pipeline stage.")
+METRICS.describe("stage_errors_total", "counter", "Pipeline stages that raised.")
+METRICS.describe("stage_inflight", "gauge", "Pipeline stages currently running.")
+METRICS.describe("job_duration_seconds", "histogram", "Wall time of a job from start to finish.")
+METRICS.describe("job_queue_seconds", "histogram", "Time a job waited for a worker.")
+METRICS.describe("jobs_total", "counter", "Finished jobs by outcome.")
+METRICS.describe("uploads_total", "counter", "Accepted uploads by how they were served.")
+
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of the process' resident memory."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def memory_stats(pid: Any = "self") -> Dict[str, float]:
+    """
+    A process' memory in MB from /proc/<pid>/smaps_rollup (Linux): rss, pss
+    (shared pages divided among the processes mapping them), shared and private.
+    Forked workers that share preloaded model weights show it as a large shared
+    and a small private part. Empty where the file does not exist.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    stats: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fh:
+            for line in fh:
+                name, _, rest = line.partition(":")
+                if name in fields:
+                    kind = fields[name]
+                    stats[kind] = stats.get(kind, 0.0) + int(rest.split()[0]) / 1024
+    except (OSError, ValueError, IndexError):
+        return {}
+    return stats
+
+
+def _collect_process():
+    pid = os.getpid()
+    for kind, mb in memory_stats().items():
+        yield "process_memory_mb", "gauge", "Memory of this server process by kind.", {"pid": pid, "kind": kind}, mb
+    yield "process_peak_rss_mb", "gauge", "High-water mark of this process' RSS.", {"pid": pid}, peak_rss_mb()
+
+
+METRICS.add_collector(_collect_process)
+
+
+class RssSampler:
+    """
+    Samples the process' RSS every `interval` seconds on one daemon thread while
+    any span is open and raises the peak of every open span, so a span's peak is
+    the highest RSS seen during that span rather than ru_maxrss, which never goes
+    down. The thread idles while no span is open.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            # a forked worker starts without the thread and must not inherit a held lock
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._open = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, sp: "Span"):
+        with self._lock:
+            self._open.add(sp)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, sp: "Span"):
+        with self._lock:
+            self._open.discard(sp)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                spans = list(self._open)
+                if not spans:
+                    self._wake.clear()
+                    continue
+            rss = current_rss_mb()
+            if rss is None:
+                # no /proc here; spans keep their start and end readings
+                return
+            for sp in spans:
+                sp.observe_rss(rss)
+            time.sleep(self.interval)
+
+
+SAMPLER = RssSampler()
+
+
+class Span:
+    """One timed stage. `audio_seconds` and `attrs` may be filled in while it runs."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, audio_seconds: Optional[float] = None,
+                 **attrs):
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+        self.audio_seconds = audio_seconds
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.duration = None
+        self.rss_start_mb = current_rss_mb()
+        self.rss_end_mb = None
+        # highest RSS sampled while the span was open (RssSampler)
+        self.peak_rss_mb = self.rss_start_mb
+        self.error = None
+
+    def observe_rss(self, rss_mb: Optional[float]):
+        if rss_mb is not None and (self.peak_rss_mb is None or rss_mb > self.peak_rss_mb):
+            self.peak_rss_mb = rss_mb
+
+    def to_dict(self, origin: float = 0.0) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent else None,
+            "depth": self.depth,
+            "thread": self.thread,
+            "offset": self.start - origin,
+            "duration": self.duration,
+            "audio_seconds": self.audio_seconds,
+            "rss_start_mb": self.rss_start_mb,
+            "rss_end_mb": self.rss_end_mb,
+            "peak_rss_mb": self.peak_rss_mb,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    """The spans of one job, in the order they finished."""
+
+    def __init__(self, trace_id: str):
+        self.id = trace_id
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {"id": self.id, "started_at": self.started_at,
+                "spans": [s.to_dict(self.started_at) for s in spans]}
+
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_span: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def tracing(trace: Optional[Trace]):
+    """Attach the spans opened in this thread to `trace`."""
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def span(name: str, audio_seconds: Optional[float] = None, **attrs):
+    """
+    Time a stage: feeds the stage histograms and, when the thread is tracing a
+    job, adds the span to that job's trace. Exceptions are recorded and re-raised.
+    """
+    sp = Span(name, _span.get(), audio_seconds, **attrs)
+    SAMPLER.add(sp)
+    token = _span.set(sp)
+    METRICS.add("stage_inflight", 1, stage=name)
+    start = time.perf_counter()
+    try:
+        yield sp
+    except BaseException as e:
+        sp.error = f"{type(e).__name__}: {e}"
+        METRICS.inc("stage_errors_total", stage=name)
+        raise
+    finally:
+        sp.duration = time.perf_counter() - start
+        SAMPLER.remove(sp)
+        sp.rss_end_mb = current_rss_mb()
+        sp.observe_rss(sp.rss_end_mb)
+        _span.reset(token)
+        METRICS.add("stage_inflight", -1, stage=name)
+        METRICS.observe("stage_duration_seconds", sp.duration, stage=name)
+        if sp.audio_seconds:
+            METRICS.inc("stage_audio_seconds_total", sp.audio_seconds, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(sp)
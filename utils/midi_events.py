@@ -0,0 +1,107 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import mido
+
+DEFAULT_TICKS_PER_BEAT = 480
+
+
+class NoteEvents:
+    """
+    Notes as parallel NumPy arrays: onset tick, duration in ticks, pitch, velocity
+    and channel. Quantizing, merging and serializing work on whole arrays; a
+    mido.MidiFile is only built when the events are written out.
+    """
+
+    def __init__(self, onset, duration, pitch, velocity, channel, ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT):
+        self.onset = np.asarray(onset, dtype=np.int64)
+        self.duration = np.asarray(duration, dtype=np.int64)
+        self.pitch = np.asarray(pitch, dtype=np.int64)
+        self.velocity = np.asarray(velocity, dtype=np.int64)
+        self.channel = np.asarray(channel, dtype=np.int64)
+        self.ticks_per_beat = ticks_per_beat
+
+    def __len__(self):
+        return len(self.onset)
+
+    @classmethod
+    def from_seconds(cls, times, pitches, tempo, duration_ticks: int = 10, velocity: int = 100,
+                     channel: int = 9, ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT) -> "NoteEvents":
+        """Fixed-length hits at `times` (seconds) for a constant tempo in BPM."""
+        times = np.asarray(times, dtype=np.float64)
+        seconds_per_tick = 60.0 / (tempo * ticks_per_beat)
+        n = len(times)
+        return cls(
+            (times / seconds_per_tick).astype(np.int64),
+            np.full(n, duration_ticks),
+            np.asarray(pitches, dtype=np.int64)[:n],
+            np.full(n, velocity),
+            np.full(n, channel),
+            ticks_per_beat,
+        )
+
+    def quantize(self, subdivision: int = 4) -> "NoteEvents":
+        """Snap onsets and note ends to 1/subdivision of a beat, like quantize_midi_file."""
+        resolution = max(1, self.ticks_per_beat // subdivision)
+        onset = np.round(self.onset / resolution).astype(np.int64) * resolution
+        end = np.round((self.onset + self.duration) / resolution).astype(np.int64) * resolution
+        return NoteEvents(onset, np.maximum(0, end - onset), self.pitch, self.velocity, self.channel,
+                          self.ticks_per_beat)
+
+    def merge(self, other: "NoteEvents") -> "NoteEvents":
+        """Both event sets in one, ordered by onset (ties keep self before other)."""
+        if other.ticks_per_beat != self.ticks_per_beat:
+            scale = self.ticks_per_beat / other.ticks_per_beat
+            other = NoteEvents(np.round(other.onset * scale), np.round(other.duration * scale),
+                               other.pitch, other.velocity, other.channel, self.ticks_per_beat)
+        merged = NoteEvents(*(np.concatenate([a, b]) for a, b in zip(self._columns(), other._columns())),
+                            ticks_per_beat=self.ticks_per_beat)
+        return merged[np.argsort(merged.onset, kind="stable")]
+
+    def __getitem__(self, index) -> "NoteEvents":
+        return NoteEvents(*(c[index] for c in self._columns()), ticks_per_beat=self.ticks_per_beat)
+
+    def _columns(self):
+        return self.onset, self.duration, self.pitch, self.velocity, self.channel
+
+    def to_midi_file(self, tempo: Optional[float] = None, numerator: int = 4, denominator: int = 4) -> mido.MidiFile:
+        """
+        Single-track MidiFile. Note i's on/off pair keeps its place among events
+        sharing a tick, the same ordering a stable sort of the message list gives.
+        """
+        mid = mido.MidiFile(ticks_per_beat=self.ticks_per_beat)
+        track = mido.MidiTrack()
+        mid.tracks.append(track)
+        if tempo is not None:
+            track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(tempo)))
+        track.append(mido.MetaMessage('time_signature', numerator=numerator, denominator=denominator))
+
+        n = len(self)
+        ticks = np.empty(2 * n, dtype=np.int64)
+        ticks[0::2] = self.onset
+        ticks[1::2] = self.onset + self.duration
+        order = np.argsort(ticks, kind="stable")
+        deltas = np.diff(ticks[order], prepend=0)
+
+        for idx, delta in zip(order.tolist(), deltas.tolist()):
+            i = idx >> 1
+            if idx & 1:
+                track.append(mido.Message('note_off', note=int(self.pitch[i]), velocity=0,
+                                          time=delta, channel=int(self.channel[i])))
+            else:
+                track.append(mido.Message('note_on', note=int(self.pitch[i]), velocity=int(self.velocity[i]),
+                                          time=delta, channel=int(self.channel[i])))
+        return mid
+
+    def save(self, path, tempo: Optional[float] = None, numerator: int = 4, denominator: int = 4) -> str:
+        self.to_midi_file(tempo, numerator, denominator).save(str(path))
+        return str(path)
+
+    def to_debug(self, track: int = 0) -> List[Dict[str, Any]]:
+        """One dict per note_on, as the old re-parse of the written file produced."""
+        order = np.argsort(self.onset, kind="stable")
+        return [
+            {"track": track, "abs_time_ticks": int(self.onset[i]), "channel": int(self.channel[i]),
+             "note": int(self.pitch[i]), "velocity": int(self.velocity[i])}
+            for i in order.tolist()
+        ]
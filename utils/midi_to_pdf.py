@@ -1,8 +1,22 @@
 import os
+import json
+import queue
 import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
 from pathlib import Path
+from typing import Dict, List, Optional
 
-def convert_midi_to_pdf(midi_path, drum_notation=False):
+from .metrics import span
+
+MUSESCORE_BIN = 'musescore3'
+RENDER_TIMEOUT = 120  # seconds per file
+BATCH_WINDOW = 0.25  # seconds to wait for other jobs' files before starting a batch
+MAX_BATCH = 16
+
+def convert_midi_to_pdf(midi_path, drum_notation=False, timeout=RENDER_TIMEOUT):
     """
     Convert MIDI -> PDF using MuseScore CLI.
     For drum notation, ensure the MIDI file puts drum notes on channel 10 (index 9).
@@ -12,12 +26,13 @@ def convert_midi_to_pdf(midi_path, drum_notation=False):
     pdf_path = os.path.splitext(midi_path)[0] + ".pdf"
 
     # Try the common Windows install paths for MuseScore
-    muse_score_bin = 'musescore3'
+    muse_score_bin = MUSESCORE_BIN
 
     cmd = [muse_score_bin, "-o", pdf_path, midi_path]
     
     try:
-        _ = subprocess.run(cmd, check=True)
+        with span("musescore", file=os.path.basename(midi_path)):
+            _ = subprocess.run(cmd, check=True, timeout=timeout)
 
     except FileNotFoundError:
         print("MuseScore executable not found at expected path. Please install MuseScore 3/4 or update path in midi_to_pdf.py.")
@@ -25,5 +40,172 @@ def convert_midi_to_pdf(midi_path, drum_notation=False):
     except subprocess.CalledProcessError as e:
         print(f"Error converting MIDI to PDF: {e}")
         return None
+    except subprocess.TimeoutExpired:
+        print(f"MuseScore timed out converting {midi_path}")
+        return None
 
     return pdf_path
+
+def _run_job_file(job_file: str, outputs: List[str], timeout: float):
+    """
+    Run `musescore -j job_file`. Each file gets `timeout`: the batch is killed
+    once that long passes without a new PDF, so a stuck file costs one file's
+    budget, not the whole batch's. The PDF written last when it is killed may be
+    cut short and is removed.
+    """
+    proc = subprocess.Popen([MUSESCORE_BIN, "-j", job_file])
+    seen = []
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                returncode = proc.wait(timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            new = [o for o in outputs if o not in seen and os.path.exists(o)]
+            if new:
+                seen.extend(new)
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() >= deadline:
+                proc.kill()
+                proc.wait()
+                if seen and os.path.exists(seen[-1]):
+                    os.remove(seen[-1])
+                raise subprocess.TimeoutExpired(proc.args, timeout)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, proc.args)
+
+def convert_batch(midi_paths: List[str], timeout=RENDER_TIMEOUT) -> Dict[str, Optional[str]]:
+    """
+    Convert several MIDI files with a single MuseScore launch using its job-file
+    mode (`-j`), `timeout` seconds per file. Files the batch did not produce are
+    retried one by one, so a file that crashes MuseScore only fails itself.
+    Returns {midi path: pdf path or None}.
+    """
+    jobs = [{"in": str(m), "out": os.path.splitext(str(m))[0] + ".pdf"} for m in midi_paths]
+    for job in jobs:
+        if os.path.exists(job["out"]):
+            os.remove(job["out"])
+
+    if len(jobs) > 1:
+        fd, job_file = tempfile.mkstemp(suffix=".json", prefix="mscore_jobs_")
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump(jobs, fh)
+            with span("musescore.batch", files=len(jobs)):
+                _run_job_file(job_file, [job["out"] for job in jobs], timeout)
+        except FileNotFoundError:
+            print("MuseScore executable not found at expected path. Please install MuseScore 3/4 or update path in midi_to_pdf.py.")
+            return {job["in"]: None for job in jobs}
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            print(f"MuseScore batch failed, retrying files individually: {e}")
+        finally:
+            os.remove(job_file)
+
+    results = {}
+    for job in jobs:
+        if os.path.exists(job["out"]):
+            results[job["in"]] = job["out"]
+        else:
+            results[job["in"]] = convert_midi_to_pdf(job["in"], timeout=timeout)
+    return results
+
+class RenderBatch:
+    """
+    One job's MIDI files for the render service. They are held back until all
+    `expected` files were submitted or skipped, then queued together, so a
+    song's stems share one MuseScore start however far apart they finish.
+    """
+
+    def __init__(self, service: "RenderService", expected: int):
+        self._service = service
+        self._pending = expected
+        self._items = []
+        self._lock = threading.Lock()
+
+    def submit(self, midi_path, drum_notation=False) -> Future:
+        """Add a conversion; the future resolves to the PDF path or None."""
+        future = Future()
+        self._add((str(midi_path), future))
+        return future
+
+    def skip(self):
+        """Give up a place for a file that will not come, e.g. a stem that failed."""
+        self._add(None)
+
+    def _add(self, item):
+        with self._lock:
+            if item is not None:
+                self._items.append(item)
+            self._pending -= 1
+            if self._pending > 0:
+                return
+            items, self._items = self._items, []
+        if items:
+            self._service._queue.put(items)
+
+class RenderService:
+    """
+    Collects MIDI -> PDF requests from every job in the process and renders them
+    in batches on a few long-running worker threads. A job hands its files over
+    together (see batch()), so a song with five stems costs one MuseScore start
+    instead of five; files of other jobs arriving within `batch_window` join in.
+    """
+
+    def __init__(self, workers: int = 1, timeout: float = RENDER_TIMEOUT,
+                 batch_window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._worker, name=f"render-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, midi_path, drum_notation=False) -> Future:
+        """Queue a conversion; the future resolves to the PDF path or None."""
+        future = Future()
+        self._queue.put([(str(midi_path), future)])
+        return future
+
+    def batch(self, expected: int) -> RenderBatch:
+        """A RenderBatch for a job that will submit (or skip) `expected` files."""
+        return RenderBatch(self, expected)
+
+    def _next_batch(self):
+        # a job's files stay together, even past max_batch
+        batch = list(self._queue.get())
+        while len(batch) < self.max_batch:
+            try:
+                batch.extend(self._queue.get(timeout=self.batch_window))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = convert_batch([m for m, _ in batch], timeout=self.timeout)
+            except Exception as e:
+                print(f"Error rendering batch: {e}")
+                results = {}
+            for midi_path, future in batch:
+                future.set_result(results.get(midi_path))
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_render_service(workers: int = 1) -> RenderService:
+    """Process-wide RenderService, started on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = RenderService(workers=workers)
+        return _service
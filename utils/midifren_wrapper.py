@@ -1,12 +1,8 @@
 import os
-import shutil
 from pathlib import Path
-from typing import Dict, Any, Optional
-from .drum_transcribe import DrumBeatExtractor, quantize_midi_file
-import mido
-
-OUTPUT_DIR = Path("output")
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+from .drum_transcribe import DrumAnalysis, DrumBeatExtractor, parse_groove
 
 def run_midifren_drums(
     drum_audio_path: str,
@@ -15,58 +11,66 @@ def run_midifren_drums(
     quantize: bool = True,
     groove: str = "4/4",
     bpm: Optional[int] = None,
+    return_debug: bool = False,
+    audio: Optional[Tuple[np.ndarray, int]] = None,
+    analysis_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Drum stem -> drums.mid in `out_dir`.
+    `audio` may carry the stem as already decoded (mono samples, sample rate); the
+    file at `drum_audio_path` is then not read. With `analysis_dir` the analysis is
+    saved there so drums_from_analysis can re-derive the MIDI with other settings.
+    """
+    # decode, trim and HPSS the stem once for both tempo detection and onset extraction
+    try:
+        if audio is not None:
+            analysis = DrumAnalysis(audio[0], audio[1], source=str(drum_audio_path))
+        else:
+            analysis = DrumAnalysis.from_file(drum_audio_path)
+    except Exception as e:
+        print(f"[midifren_wrapper] could not decode {drum_audio_path}: {e}")
+        return {"midi_path": None, "pdf_path": None, "debug": None}
+
+    res = drums_from_analysis(analysis, out_dir, sensitivity, quantize, groove, bpm, return_debug)
+    if analysis_dir is not None and res["midi_path"]:
+        try:
+            analysis.save(analysis_dir)
+        except Exception as e:
+            print(f"[midifren_wrapper] could not save analysis to {analysis_dir}: {e}")
+    return res
+
+def drums_from_analysis(
+    analysis: DrumAnalysis,
+    out_dir: str,
+    sensitivity: float = 0.45,
+    quantize: bool = True,
+    groove: str = "4/4",
+    bpm: Optional[int] = None,
     return_debug: bool = False
 ) -> Dict[str, Any]:
+    """Onsets, tempo and drums.mid in `out_dir` from a fresh or saved DrumAnalysis."""
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
     extractor = DrumBeatExtractor()
     if bpm is None:
-        bpm = extractor.detect_tempo(drum_audio_path)
+        bpm = extractor.detect_tempo(analysis)
 
-    midi_path_generated = extractor.extract_midi(
-        drum_audio_path,
-        tempo=bpm,
-        sensitivity=sensitivity,
-        groove=groove,
-        quantize=quantize,
-        web=False
-    )
-
-    if not midi_path_generated:
+    events = extractor.extract_events(analysis, tempo=bpm, sensitivity=sensitivity)
+    if events is None:
         return {"midi_path": None, "pdf_path": None, "debug": None}
 
-    midi_generated_path = Path(midi_path_generated)
+    # quantize once in memory and write the MIDI file exactly once, straight into out_dir
+    if quantize:
+        events = events.quantize(subdivision=4)
+    nom, denom = parse_groove(groove)
     midi_final = out_dir / "drums.mid"
     try:
-        if midi_generated_path.resolve() != midi_final.resolve():
-            if midi_final.exists():
-                midi_final.unlink()
-            shutil.move(str(midi_generated_path), str(midi_final))
-    except Exception:
-        if not midi_final.exists() and midi_generated_path.exists():
-            shutil.copy(str(midi_generated_path), str(midi_final))
-
-    if quantize:
-        try:
-            tmp = out_dir / "drums.quant_tmp.mid"
-            quantize_midi_file(str(midi_final), str(tmp), bpm, subdivision=4)
-            shutil.move(str(tmp), str(midi_final))
-        except Exception:
-            print("[midifren_wrapper] quantize pass failed; continuing")
-
-    midi_str = str(midi_final) if midi_final.exists() else None
+        midi_str = events.save(midi_final, tempo=bpm, numerator=nom, denominator=denom)
+    except Exception as e:
+        print(f"[midifren_wrapper] could not write {midi_final}: {e}")
+        midi_str = None
     pdf_str = None
 
-    debug_list = None
-    if return_debug and midi_str:
-        import mido as _mido
-        debug_list = []
-        mid = _mido.MidiFile(midi_str)
-        for tr_idx, track in enumerate(mid.tracks):
-            abs_t = 0
-            for msg in track:
-                abs_t += msg.time
-                if msg.type == "note_on":
-                    debug_list.append({"track": tr_idx, "abs_time_ticks": abs_t, "channel": getattr(msg, "channel", None), "note": getattr(msg, "note", None), "velocity": getattr(msg, "velocity", None)})
+    debug_list = events.to_debug() if return_debug and midi_str else None
     return {"midi_path": midi_str, "pdf_path": pdf_str, "debug": debug_list}
@@ -0,0 +1,150 @@
+import importlib.util
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import METRICS, span
+
+DEMUCS_MODEL = "htdemucs_6s"
+# formats basic-pitch ships its ICASSP 2022 model in; "default" is whichever its installed runtime prefers
+BASIC_PITCH_BACKENDS = ("default", "tf", "onnx", "tflite", "coreml")
+# modules a backend can run on (any one will do), and the backend a model file's extension implies
+BACKEND_RUNTIMES = {"tf": ("tensorflow",), "onnx": ("onnxruntime",), "tflite": ("tflite_runtime", "tensorflow"),
+                    "coreml": ("coremltools",)}
+MODEL_FILE_BACKENDS = {".onnx": "onnx", ".tflite": "tflite", ".mlpackage": "coreml"}
+
+# loaded models live for the lifetime of the worker process
+_models: Dict[str, Any] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+# intra-op threads for torch and TensorFlow; None keeps the library defaults (every core)
+_threads: Dict[str, Optional[int]] = {"torch": None, "tf": None}
+
+
+def set_thread_limits(torch_threads: Optional[int] = None, tf_threads: Optional[int] = None):
+    """Cap the threads Demucs and basic-pitch use per call. Call before the models are loaded."""
+    _threads["torch"] = torch_threads
+    _threads["tf"] = tf_threads
+
+
+def limit_torch_threads():
+    """torch keeps its thread count per calling thread, so apply it where the model runs."""
+    n = _threads["torch"]
+    if n:
+        import torch
+        if torch.get_num_threads() != n:
+            torch.set_num_threads(n)
+
+
+def _limit_tf_threads(model_path):
+    # only the SavedModel backend runs on TensorFlow; must happen before TF starts its pools
+    n = _threads["tf"]
+    if not n or os.path.splitext(str(model_path))[1] or importlib.util.find_spec("tensorflow") is None:
+        return
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(n)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError as e:
+        print(f"[models] TensorFlow already initialized, thread limit not applied: {e}")
+
+
+def _limit_runtime_threads(model, model_path):
+    # ONNX Runtime and TFLite keep their own pools; rebuild them CPU-only with the thread cap
+    n = _threads["tf"]
+    path = str(model_path)
+    if not n:
+        return
+    if path.endswith(".onnx"):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = n
+        options.inter_op_num_threads = 1
+        model.model = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+    elif path.endswith(".tflite") and hasattr(model, "interpreter"):
+        model.interpreter = type(model.interpreter)(path, num_threads=n)
+        model.model = model.interpreter.get_signature_runner()
+
+
+def basic_pitch_model_path(backend: Optional[str] = None):
+    """Bundled basic-pitch model for a backend in BASIC_PITCH_BACKENDS; anything else is taken as a model file."""
+    if not backend or backend == "default":
+        # basic_pitch pulls in TensorFlow (or ONNX Runtime); imported only once a model is wanted
+        from basic_pitch import ICASSP_2022_MODEL_PATH
+        return ICASSP_2022_MODEL_PATH
+    if backend in BASIC_PITCH_BACKENDS:
+        from basic_pitch import FilenameSuffix, build_icassp_2022_model_path
+        return build_icassp_2022_model_path(FilenameSuffix[backend])
+    if not os.path.exists(backend):
+        raise ValueError(f"unknown basic-pitch backend or model file: {backend}")
+    return backend
+
+
+def basic_pitch_backend_available(backend: Optional[str] = None) -> bool:
+    """Whether the runtime a backend (or model file) needs is installed; checked without importing it."""
+    if not backend or backend == "default":
+        return True
+    if backend not in BASIC_PITCH_BACKENDS:
+        backend = MODEL_FILE_BACKENDS.get(os.path.splitext(str(backend))[1].lower(), "tf")
+    return any(importlib.util.find_spec(m) is not None for m in BACKEND_RUNTIMES[backend])
+
+
+def _get_or_load(key: str, loader: Callable[[], Any]) -> Any:
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    # one lock per model so a slow Demucs load does not block basic-pitch
+    with lock:
+        model = _models.get(key)
+        if model is None:
+            print(f"[models] loading {key}")
+            with span("model.load", model=key):
+                model = loader()
+            _models[key] = model
+    return model
+
+
+def get_demucs(name: str = DEMUCS_MODEL):
+    """Pretrained Demucs model (or bag of models), loaded once per process."""
+    def load():
+        from demucs.pretrained import get_model
+        model = get_model(name)
+        model.eval()
+        return model
+    return _get_or_load(f"demucs:{name}", load)
+
+
+def get_basic_pitch(model_path=None):
+    """basic-pitch inference Model for `model_path` (the default backend if None), loaded once per process."""
+    model_path = model_path or basic_pitch_model_path()
+
+    def load():
+        from basic_pitch.inference import Model
+        _limit_tf_threads(model_path)
+        model = Model(model_path)
+        _limit_runtime_threads(model, model_path)
+        return model
+    return _get_or_load(f"basic_pitch:{model_path}", load)
+
+
+def warm_models(demucs_model: str = DEMUCS_MODEL, basic_pitch_path=None):
+    """Load the models a profile uses so the first job does not pay for it."""
+    try:
+        get_demucs(demucs_model)
+        get_basic_pitch(basic_pitch_path)
+    except Exception as e:
+        print(f"[models] warm-up failed: {e}")
+
+
+def loaded_models():
+    return sorted(_models)
+
+
+def _collect():
+    for key in loaded_models():
+        yield "models_loaded", "gauge", "Models resident in this process.", {"model": key, "pid": os.getpid()}, 1
+
+
+METRICS.add_collector(_collect)
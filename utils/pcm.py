@@ -0,0 +1,38 @@
+import os
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+# a decoded stem kept with a result: mono float32 .npy, pcm_<name>_<sample rate>.npy
+PCM_PREFIX = "pcm_"
+
+
+def pcm_file(directory: str, name: str, sr: int) -> str:
+    return os.path.join(directory, f"{PCM_PREFIX}{name}_{int(sr)}.npy")
+
+
+def store_pcm(directory: str, name: str, y: np.ndarray, sr: int) -> str:
+    """Write mono samples as float32 .npy, atomically; an entry that exists is left alone."""
+    path = pcm_file(directory, name, sr)
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            np.save(fh, np.asarray(y, dtype=np.float32))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def open_pcm(directory: str, name: str, sr: int) -> Optional[np.ndarray]:
+    """A stored entry, memory-mapped: slices are views of the page cache, not copies. None if missing."""
+    path = pcm_file(directory, name, sr)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
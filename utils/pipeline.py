@@ -0,0 +1,412 @@
+import json
+import os
+import shutil
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import span
+from .dag import StageGraph
+from .profiles import Profile, get_profile
+from .scheduler import DRUMS, SEPARATE, TRANSCRIBE, get_scheduler
+from .midi_to_pdf import get_render_service
+from .cache import INCOMPLETE_FILE
+
+# torch, Demucs, basic-pitch/TensorFlow and librosa are imported inside the functions
+# that use them, so importing this module (and the web app) stays cheap
+
+ALL_STEMS = ["bass", "drums", "piano", "guitar", "vocals"]
+META_FILE = "meta.json"
+DRUM_SENSITIVITY = 0.45
+STEM_FORMATS = ("mp3", "flac", "wav")
+# per-result folder with the intermediate analysis re-transcription works from
+ANALYSIS_DIR = "_analysis"
+
+# settings retranscribe_result understands, with the values process_song uses
+RETRANSCRIBE_DEFAULTS = {
+    "sensitivity": DRUM_SENSITIVITY,
+    "groove": "4/4",
+    "quantize": True,
+    "bpm": None,
+    "onset_threshold": 0.5,
+    "frame_threshold": 0.3,
+    "minimum_note_length": 127.70,
+    "melodia_trick": True,
+}
+
+
+def _noop_progress(stage, detail=None):
+    pass
+
+
+def find_stem_file(out_dir: str, stem: str) -> Optional[str]:
+    for ext in STEM_FORMATS:
+        path = os.path.join(out_dir, f"{stem}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def processing_params(
+    stems: List[str],
+    drum_sensitivity: float = DRUM_SENSITIVITY,
+    stem_format: str = "mp3",
+    render_pdf: bool = True,
+    window: Optional[Tuple[float, float]] = None,
+    profile: Optional[Profile] = None
+) -> Dict[str, Any]:
+    """Parameters that change the pipeline output; part of the result cache key."""
+    profile = profile or get_profile()
+    params = {"model": profile.demucs_model, "stems": list(stems), "format": stem_format, "pdf": render_pdf}
+    params.update(profile.params())
+    if "drums" in stems:
+        params["drum_sensitivity"] = drum_sensitivity
+    if window is not None:
+        params["window"] = [float(window[0]), float(window[1])]
+    return params
+
+
+def midi_name(stem: str) -> str:
+    return "drums.mid" if stem == "drums" else f"{stem}_basic_pitch.mid"
+
+
+def posteriors_path(analysis_dir: str, stem: str) -> str:
+    return os.path.join(analysis_dir, f"{stem}_posteriors.npz")
+
+
+def transcribe_stem(
+    stem: str,
+    stem_file: str,
+    out_dir: str,
+    drum_sensitivity: float = DRUM_SENSITIVITY,
+    audio: Optional[Tuple[np.ndarray, int]] = None,
+    analysis_dir: Optional[str] = None,
+    basic_pitch_path=None
+) -> Optional[str]:
+    """
+    Generate the MIDI file for one separated stem and return its path.
+    With `audio` (mono samples, sample rate) the stem is taken from memory and
+    `stem_file` only names the outputs. With `analysis_dir` the drum analysis or
+    basic-pitch posteriors are kept there for retranscribe_result.
+    `basic_pitch_path` picks the basic-pitch backend (default: the bundled one).
+    """
+    from .midifren_wrapper import run_midifren_drums
+    from .transcribe import transcribe_array, transcribe_to_midi
+
+    posteriors = posteriors_path(analysis_dir, stem) if analysis_dir else None
+    if stem == "drums":
+        # call the MIDIfren wrapper which runs the MIDIfren-style extraction
+        res = run_midifren_drums(
+            drum_audio_path=stem_file,
+            out_dir=out_dir,
+            sensitivity=drum_sensitivity,  # lower => more onsets
+            quantize=True,
+            groove="4/4",
+            bpm=None,
+            return_debug=False,
+            audio=audio,
+            analysis_dir=analysis_dir
+        )
+        return res.get("midi_path")
+    if audio is not None:
+        return transcribe_array(audio[0], audio[1], os.path.join(out_dir, midi_name(stem)), posteriors,
+                                basic_pitch_path)
+    midi_path = transcribe_to_midi(stem_file, posteriors, basic_pitch_path)
+    if midi_path and os.path.exists(midi_path):
+        return midi_path
+    return None
+
+
+def wait_for_renders(renders: Dict[str, Any], progress: Callable[..., None],
+                     failed: Optional[Dict[str, str]] = None):
+    """
+    Wait for the PDFs submitted to the render service; a failed file only loses its PDF,
+    which is noted in `failed` ({stem: reason}) when given.
+    Returns {stem: pdf path or None}.
+    """
+    pdfs = {}
+    for s, future in renders.items():
+        progress("rendering", s)
+        with span("render_wait", stem=s) as sp:
+            pdfs[s] = future.result()
+            if pdfs[s] is None:
+                sp.error = "no PDF rendered"
+                print(f"[info] no PDF rendered for {s}")
+                if failed is not None:
+                    failed[s] = "no PDF rendered"
+    return pdfs
+
+
+def write_meta(out_dir: str, song_name: str, stems: List[str], params: Dict[str, Any],
+               extra: Optional[Dict[str, Any]] = None, failed: Optional[Dict[str, str]] = None):
+    """meta.json marks a finished result; write it last. `failed` lists stems that lost outputs."""
+    meta = dict(extra or {}, song_name=song_name, stems=stems, params=params)
+    if failed:
+        meta["failed"] = failed
+    with open(os.path.join(out_dir, META_FILE), "w") as fh:
+        json.dump(meta, fh)
+
+
+def process_song(
+    filepath: str,
+    out_dir: str,
+    stems: List[str],
+    song_name: str,
+    progress: Callable[..., None] = _noop_progress,
+    drum_sensitivity: float = DRUM_SENSITIVITY,
+    in_memory: bool = True,
+    stem_format: str = "mp3",
+    stream_min_seconds: float = 0,
+    max_memory_mb: float = 1024,
+    render_pdf: bool = True,
+    keep_analysis: bool = True,
+    stem_workers: int = 2,
+    window: Optional[Tuple[float, float]] = None,
+    extra_meta: Optional[Dict[str, Any]] = None,
+    profile: Optional[Profile] = None
+):
+    """
+    Full pipeline for one upload: separation, then MIDI and PDF for every stem.
+    Everything is written below `out_dir`, together with a meta.json that the
+    results page reads.
+
+    With `in_memory` the separated stems go straight from Demucs to the
+    transcription stages; the downloadable stem files are encoded in the
+    background meanwhile. Otherwise stems are written first and decoded again.
+
+    Recordings longer than `stream_min_seconds` (0 disables) are processed in
+    chunks sized to `max_memory_mb`, see utils/streaming.py.
+
+    After separation every stem is a branch of a StageGraph, transcription then
+    PDF, run on `stem_workers` threads: drum DSP and basic-pitch overlap, and a
+    failing stem only loses its own outputs. PDFs go through the shared render
+    service as one batch per job, a single MuseScore start for all stems;
+    `render_pdf` False skips notation entirely.
+
+    Separation and each stem's transcription take a slot of the process-wide
+    scheduler first, so concurrent jobs queue for the CPU instead of sharing it.
+
+    With `keep_analysis` the drum onset analysis and basic-pitch posteriors are
+    saved in the result's _analysis folder (not for chunked recordings), so
+    retranscribe_result can redo the MIDI with other settings.
+
+    `window` (start, end) in seconds limits everything to that excerpt, for a fast
+    preview; it is separated with context padding and handed over in memory.
+    `extra_meta` is merged into meta.json.
+
+    `profile` (see utils/profiles.py, default "balanced") picks the Demucs model
+    and settings and the basic-pitch backend.
+
+    Returns {stem: reason} for the stems whose transcription raised or whose PDF
+    was not rendered (also kept in meta.json as "failed"); empty when all went well.
+    """
+    from .separate import separate_file, separate_to_memory, save_stems_async
+    from .streaming import audio_duration, separate_window, stream_song
+
+    os.makedirs(out_dir, exist_ok=True)
+    analysis_dir = os.path.join(out_dir, ANALYSIS_DIR) if keep_analysis else None
+    scheduler = get_scheduler()
+    profile = profile or get_profile()
+    demucs_model, demucs_options, basic_pitch_path = \
+        profile.demucs_model, profile.demucs_options(), profile.basic_pitch_path()
+    params = processing_params(stems, drum_sensitivity, stem_format, render_pdf, window, profile)
+    renderer = get_render_service() if render_pdf else None
+    renders = {}
+    failed = {}
+    if window is not None:
+        in_memory = True
+
+    if window is None and stream_min_seconds and audio_duration(filepath) > stream_min_seconds:
+        # chunks alternate between Demucs and transcription; the whole run counts as one separation
+        with scheduler.slot(SEPARATE, on_wait=lambda: progress("waiting", "separation")), \
+                span("stream", stems=",".join(stems)):
+            midi_paths = stream_song(filepath, out_dir, stems, max_memory_mb, drum_sensitivity,
+                                     stem_format=stem_format, progress=progress, model_name=demucs_model,
+                                     demucs_options=demucs_options, basic_pitch_path=basic_pitch_path)
+        failed.update((s, "no MIDI produced") for s, midi_path in midi_paths.items() if not midi_path)
+        if renderer:
+            group = renderer.batch(sum(1 for midi_path in midi_paths.values() if midi_path))
+            for s, midi_path in midi_paths.items():
+                if midi_path:
+                    renders[s] = group.submit(midi_path, drum_notation=(s == "drums"))
+        wait_for_renders(renders, progress, failed)
+        write_meta(out_dir, song_name, stems, params, extra_meta, failed)
+        return failed
+
+    encoding = None
+    with scheduler.slot(SEPARATE, on_wait=lambda: progress("waiting", "separation")):
+        progress("separating")
+        with span("separate", stems=",".join(stems), profile=profile.name):
+            if window is not None:
+                outputs, samplerate = separate_window(filepath, stems, window[0], window[1], model_name=demucs_model,
+                                                      options=demucs_options)
+            elif in_memory:
+                outputs, samplerate = separate_to_memory(filepath, stems, model_name=demucs_model,
+                                                         options=demucs_options)
+            else:
+                separate_file(filepath, out_dir, stems, model_name=demucs_model, ext=stem_format,
+                              options=demucs_options)
+    if in_memory:
+        encoding = save_stems_async(outputs, samplerate, out_dir, stem_format)
+
+    def transcribe(s, stem_file, audio):
+        kind = DRUMS if s == "drums" else TRANSCRIBE
+        midi_path = None
+        try:
+            with scheduler.slot(kind, on_wait=lambda: progress("waiting", "transcription")):
+                progress("transcribing", s)
+                with span("transcribe", audio_seconds=len(audio[0]) / audio[1] if audio else None, stem=s) as sp:
+                    midi_path = transcribe_stem(s, stem_file, out_dir, drum_sensitivity, audio=audio,
+                                                analysis_dir=analysis_dir, basic_pitch_path=basic_pitch_path)
+                    if not midi_path:
+                        # the drum wrapper reports decode and analysis errors by returning no MIDI
+                        sp.error = failed[s] = "no MIDI produced"
+                    return midi_path
+        finally:
+            # the job's PDFs go to MuseScore together once every transcription has ended
+            if group is not None:
+                if midi_path:
+                    renders[s] = group.submit(midi_path, drum_notation=(s == "drums"))
+                else:
+                    group.skip()
+
+    def render(s, midi_path):
+        if not midi_path:
+            return None
+        progress("rendering", s)
+        return wait_for_renders({s: renders[s]}, _noop_progress, failed)[s]
+
+    graph = StageGraph(max_workers=stem_workers)
+    for s in stems:
+        audio = None
+        if in_memory:
+            if s not in outputs:
+                print(f"[info] stem {s} not produced by {demucs_model}")
+                continue
+            stem_file = os.path.join(out_dir, f"{s}.{stem_format}")
+            audio = (outputs[s].mean(0).cpu().numpy(), samplerate)
+        else:
+            stem_file = find_stem_file(out_dir, s)
+            if stem_file is None:
+                print(f"[info] stem file not found for {s} in {out_dir}")
+                failed[s] = "stem file not found"
+                continue
+        graph.add(f"transcribe:{s}", partial(transcribe, s, stem_file, audio))
+    group = renderer.batch(sum(1 for s in stems if f"transcribe:{s}" in graph)) if renderer else None
+    # render stages are added last so a free worker prefers starting another transcription
+    if renderer:
+        for s in stems:
+            if f"transcribe:{s}" in graph:
+                graph.add(f"render:{s}", partial(render, s), deps=[f"transcribe:{s}"])
+
+    for name, result in graph.run().items():
+        if result.status == "failed":
+            print(f"Error processing stem {name.split(':', 1)[1]} ({name}): {result.error}")
+            failed.setdefault(name.split(':', 1)[1], f"{type(result.error).__name__}: {result.error}")
+
+    progress("finalizing")
+    if encoding is not None:
+        with span("encode_wait"):
+            encoding.result()
+    write_meta(out_dir, song_name, stems, params, extra_meta, failed)
+    return failed
+
+
+def retranscribable_stems(result_dir: str) -> List[str]:
+    """Stems of a finished result whose saved analysis allows retranscribe_result."""
+    from .drum_transcribe import ANALYSIS_FILE
+
+    analysis_dir = os.path.join(result_dir, ANALYSIS_DIR)
+    stems = []
+    for s in ALL_STEMS:
+        if s == "drums":
+            found = os.path.exists(os.path.join(analysis_dir, ANALYSIS_FILE))
+        else:
+            found = os.path.exists(posteriors_path(analysis_dir, s))
+        if found:
+            stems.append(s)
+    return stems
+
+
+def _link(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def retranscribe_result(
+    src_dir: str,
+    out_dir: str,
+    stems: List[str],
+    options: Dict[str, Any],
+    render_pdf: bool = False
+) -> Dict[str, Optional[str]]:
+    """
+    Build a new result in `out_dir` from the finished result in `src_dir`, with the
+    MIDI of `stems` redone from the saved analysis under `options` (keys of
+    RETRANSCRIBE_DEFAULTS). Neither Demucs nor a neural model runs: drums are
+    re-picked from the onset envelope, other stems re-decoded from the posteriors.
+    Everything else is hard-linked from `src_dir`. PDFs of the redone stems are
+    only produced with `render_pdf`. meta.json is written last, as in process_song;
+    it keeps the parent's failures of stems that were not redone. The new result is
+    complete as far as the saved analysis allows, so it carries no .incomplete marker.
+    Returns {stem: midi path or None}.
+    """
+    opts = dict(RETRANSCRIBE_DEFAULTS, **options)
+    from .drum_transcribe import DrumAnalysis
+    from .midifren_wrapper import drums_from_analysis
+    from .transcribe import load_posteriors, notes_from_posteriors
+
+    src_analysis = os.path.join(src_dir, ANALYSIS_DIR)
+    analysis_dir = os.path.join(out_dir, ANALYSIS_DIR)
+    os.makedirs(analysis_dir, exist_ok=True)
+
+    redone = set()
+    for s in stems:
+        redone.add(midi_name(s))
+        redone.add(os.path.splitext(midi_name(s))[0] + ".pdf")
+    for name in os.listdir(src_dir):
+        path = os.path.join(src_dir, name)
+        # the parent's failures are carried over in meta.json, not through its .incomplete marker
+        if name not in (META_FILE, INCOMPLETE_FILE) and name not in redone and os.path.isfile(path):
+            _link(path, os.path.join(out_dir, name))
+    for name in os.listdir(src_analysis):
+        _link(os.path.join(src_analysis, name), os.path.join(analysis_dir, name))
+
+    renderer = get_render_service() if render_pdf else None
+    renders = {}
+    midi_paths = {}
+    for s in stems:
+        with span("retranscribe", stem=s):
+            if s == "drums":
+                analysis = DrumAnalysis.load(analysis_dir)
+                res = drums_from_analysis(analysis, out_dir, sensitivity=opts["sensitivity"],
+                                          quantize=opts["quantize"], groove=opts["groove"], bpm=opts["bpm"])
+                midi_path = res["midi_path"]
+                # keep the frames this sensitivity classified for the next tweak
+                analysis.save(analysis_dir)
+            else:
+                midi_data, _ = notes_from_posteriors(
+                    load_posteriors(posteriors_path(analysis_dir, s)),
+                    onset_threshold=opts["onset_threshold"],
+                    frame_threshold=opts["frame_threshold"],
+                    minimum_note_length=opts["minimum_note_length"],
+                    melodia_trick=opts["melodia_trick"])
+                midi_path = os.path.join(out_dir, midi_name(s))
+                midi_data.write(midi_path)
+        midi_paths[s] = midi_path
+
+    if renderer:
+        group = renderer.batch(sum(1 for midi_path in midi_paths.values() if midi_path))
+        for s, midi_path in midi_paths.items():
+            if midi_path:
+                renders[s] = group.submit(midi_path, drum_notation=(s == "drums"))
+    wait_for_renders(renders, _noop_progress)
+    with open(os.path.join(src_dir, META_FILE)) as fh:
+        meta = json.load(fh)
+    params = dict(meta.get("params", {}), retranscribe={"stems": stems, "options": opts, "pdf": render_pdf})
+    failed = {s: reason for s, reason in meta.get("failed", {}).items() if s not in stems}
+    write_meta(out_dir, meta.get("song_name", ""), meta.get("stems", stems), params, failed=failed)
+    return midi_paths
@@ -0,0 +1,72 @@
+from typing import Any, Dict, Optional
+
+from .models import DEMUCS_MODEL, basic_pitch_backend_available, basic_pitch_model_path
+
+DEFAULT_PROFILE = "balanced"
+
+
+class Profile:
+    """
+    Quality/speed trade-off for one job: which Demucs model runs with which
+    apply_model settings, and which basic-pitch backend transcribes. `basic_pitch`
+    is a bundled backend name (see BASIC_PITCH_BACKENDS) or a model file, e.g. an
+    int8-quantized TFLite export.
+    """
+
+    def __init__(self, name: str, demucs_model: str = DEMUCS_MODEL, shifts: int = 1, overlap: float = 0.25,
+                 segment: Optional[float] = None, basic_pitch: str = "default"):
+        self.name = name
+        self.demucs_model = demucs_model
+        self.shifts = shifts
+        self.overlap = overlap
+        self.segment = segment
+        self.basic_pitch = basic_pitch
+
+    def demucs_options(self) -> Dict[str, Any]:
+        """Keyword arguments for demucs.apply.apply_model."""
+        options = {"shifts": self.shifts, "overlap": self.overlap}
+        if self.segment:
+            options["segment"] = self.segment
+        return options
+
+    def basic_pitch_path(self):
+        return basic_pitch_model_path(self.basic_pitch)
+
+    def available(self) -> bool:
+        """Whether the runtime of its basic-pitch backend is installed."""
+        return basic_pitch_backend_available(self.basic_pitch)
+
+    def params(self) -> Dict[str, Any]:
+        """Cache-key parameters. The default profile adds none, so results from before profiles keep their ids."""
+        if self.name == DEFAULT_PROFILE:
+            return {}
+        return {"profile": self.name, "shifts": self.shifts, "overlap": self.overlap,
+                "segment": self.segment, "basic_pitch": self.basic_pitch}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.demucs_options(), name=self.name, model=self.demucs_model, basic_pitch=self.basic_pitch)
+
+
+PROFILES: Dict[str, Profile] = {}
+
+
+def add_profile(profile: Profile) -> Optional[Profile]:
+    """Register `profile`; one whose basic-pitch runtime is not installed is left out and None returned."""
+    if not profile.available():
+        print(f"[profiles] {profile.name}: runtime for basic-pitch backend {profile.basic_pitch} not installed")
+        return None
+    PROFILES[profile.name] = profile
+    return profile
+
+
+# two shifted passes average out Demucs' edge artefacts at twice the cost
+add_profile(Profile("quality", shifts=2, overlap=0.25))
+# what the pipeline always did
+add_profile(Profile(DEFAULT_PROFILE))
+# less window overlap and basic-pitch on ONNX Runtime instead of TensorFlow (only with onnxruntime installed)
+add_profile(Profile("fast", overlap=0.1, basic_pitch="onnx"))
+
+
+def get_profile(name: Optional[str] = None) -> Profile:
+    """Profile by name; None means the default. Raises KeyError for unknown names."""
+    return PROFILES[name or DEFAULT_PROFILE]
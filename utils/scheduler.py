@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from .metrics import METRICS, span
+
+SEPARATE = "separate"
+TRANSCRIBE = "transcribe"
+# drum transcription is librosa DSP, not a model, and can run beside basic-pitch
+DRUMS = "drums"
+
+METRICS.describe("scheduler_wait_seconds", "histogram", "Time a stage waited for a CPU slot.")
+
+
+def partition_threads(cpu_count: int, separate_slots: int, transcribe_slots: int) -> Tuple[int, int]:
+    """
+    Split the cores between torch (Demucs) and TensorFlow (basic-pitch).
+    Every slot that may run at the same time gets an equal share. torch gives
+    each calling thread its own intra-op team, so its count is per separation;
+    TensorFlow shares one intra-op pool across calls, so it gets the share of
+    all transcription slots together. Returns (torch threads, tf threads).
+    """
+    share = max(1, cpu_count // max(1, separate_slots + transcribe_slots))
+    return share, share * max(1, transcribe_slots)
+
+
+class Scheduler:
+    """
+    Per-host caps on the CPU-heavy stages. A stage runs inside `slot(kind)`,
+    which blocks until one of that kind's slots is free; waiting and running
+    counts and the wait times are exported as metrics.
+    """
+
+    def __init__(self, separate_slots: int = 1, transcribe_slots: int = 1, drum_slots: int = 1):
+        self.slots = {SEPARATE: max(1, separate_slots), TRANSCRIBE: max(1, transcribe_slots),
+                      DRUMS: max(1, drum_slots)}
+        self._sems = {k: threading.Semaphore(n) for k, n in self.slots.items()}
+        self._lock = threading.Lock()
+        self._waiting = {k: 0 for k in self.slots}
+        self._active = {k: 0 for k in self.slots}
+        METRICS.add_collector(self._collect)
+
+    @contextmanager
+    def slot(self, kind: str, on_wait: Optional[Callable[[], None]] = None):
+        """Hold one `kind` slot for the duration of the block; `on_wait` is called if it has to queue."""
+        sem = self._sems[kind]
+        start = time.monotonic()
+        if not sem.acquire(blocking=False):
+            with self._lock:
+                self._waiting[kind] += 1
+            try:
+                if on_wait:
+                    on_wait()
+                with span(f"wait.{kind}"):
+                    sem.acquire()
+            finally:
+                with self._lock:
+                    self._waiting[kind] -= 1
+        METRICS.observe("scheduler_wait_seconds", time.monotonic() - start, resource=kind)
+        with self._lock:
+            self._active[kind] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active[kind] -= 1
+            sem.release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {k: {"slots": self.slots[k], "active": self._active[k], "waiting": self._waiting[k]}
+                    for k in self.slots}
+
+    def _collect(self):
+        for kind, s in self.stats().items():
+            yield "scheduler_slots", "gauge", "CPU slots per stage kind.", {"resource": kind}, s["slots"]
+            yield "scheduler_active", "gauge", "Stages holding a CPU slot.", {"resource": kind}, s["active"]
+            yield "scheduler_waiting", "gauge", "Stages waiting for a CPU slot.", {"resource": kind}, s["waiting"]
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(separate_slots: int = 1, transcribe_slots: int = 1, drum_slots: int = 1) -> Scheduler:
+    """Process-wide Scheduler; the slot counts only apply to the first call."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(separate_slots, transcribe_slots, drum_slots)
+        return _scheduler
+
+
+def default_cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
@@ -0,0 +1,87 @@
+import contextvars
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from demucs.apply import apply_model
+from demucs.audio import AudioFile, save_audio
+
+from .metrics import span
+from .models import DEMUCS_MODEL, get_demucs, limit_torch_threads
+
+# stem files for download are encoded off the critical path
+_encoder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="encode")
+# apply_model settings; a profile may override them
+DEMUCS_OPTIONS = {"shifts": 1, "overlap": 0.25}
+
+
+def load_track(path: str, model) -> torch.Tensor:
+    """Decode `path` at the model's sample rate and channel count, shape (channels, samples)."""
+    with span("decode") as sp:
+        wav = AudioFile(path).read(streams=0, samplerate=model.samplerate, channels=model.audio_channels)
+        sp.audio_seconds = wav.shape[-1] / model.samplerate
+    return wav
+
+
+def separate_track(wav: torch.Tensor, model, options: Optional[Dict[str, Any]] = None) -> Dict[str, torch.Tensor]:
+    """Run the model on a decoded track and return one tensor per source. `options` override DEMUCS_OPTIONS."""
+    limit_torch_threads()
+    options = dict(DEMUCS_OPTIONS, **(options or {}))
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std() + 1e-8
+    with span("demucs", audio_seconds=wav.shape[-1] / model.samplerate, **options), torch.no_grad():
+        sources = apply_model(model, ((wav - mean) / std)[None], split=True, progress=False, **options)[0]
+    sources = sources * std + mean
+    return dict(zip(model.sources, sources))
+
+
+def select_outputs(sources: Dict[str, torch.Tensor], stems: List[str]) -> Dict[str, torch.Tensor]:
+    """
+    All sources, or with a single stem what `demucs --two-stems` writes:
+    the stem plus `no_<stem>`, the sum of everything else.
+    """
+    if len(stems) != 1:
+        return sources
+    sources = dict(sources)
+    stem = stems[0]
+    if stem not in sources:
+        raise ValueError(f"stem {stem} is not produced by the separation model")
+    selected = sources.pop(stem)
+    return {stem: selected, f"no_{stem}": sum(sources.values())}
+
+
+def separate_to_memory(filepath: str, stems: List[str], model_name: str = DEMUCS_MODEL,
+                       options: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, torch.Tensor], int]:
+    """Separate `filepath` and keep the stems in memory. Returns (stems, sample rate)."""
+    model = get_demucs(model_name)
+    sources = separate_track(load_track(filepath, model), model, options)
+    return select_outputs(sources, stems), model.samplerate
+
+
+def save_stems(outputs: Dict[str, torch.Tensor], samplerate: int, out_dir: str, ext: str = "mp3") -> List[str]:
+    """Encode every stem to `<out_dir>/<name>.<ext>` and return the written paths."""
+    kwargs = {"samplerate": samplerate, "bitrate": 320, "preset": 2, "clip": "rescale",
+              "as_float": False, "bits_per_sample": 16}
+    written = []
+    for name, source in outputs.items():
+        path = os.path.join(out_dir, f"{name}.{ext}")
+        with span("encode", audio_seconds=source.shape[-1] / samplerate, stem=name, format=ext):
+            save_audio(source.cpu(), path, **kwargs)
+        written.append(path)
+    return written
+
+
+def save_stems_async(outputs: Dict[str, torch.Tensor], samplerate: int, out_dir: str, ext: str = "mp3") -> Future:
+    """`save_stems` on the background encoder pool; its spans still count towards the caller's trace."""
+    return _encoder.submit(contextvars.copy_context().run, save_stems, outputs, samplerate, out_dir, ext)
+
+
+def separate_file(filepath: str, out_dir: str, stems: List[str], model_name: str = DEMUCS_MODEL, ext: str = "mp3",
+                  options: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Separate `filepath` with a resident Demucs model and write the stems into `out_dir`.
+    Returns the written paths.
+    """
+    outputs, samplerate = separate_to_memory(filepath, stems, model_name, options)
+    return save_stems(outputs, samplerate, out_dir, ext)
@@ -0,0 +1,236 @@
+import math
+import os
+import subprocess
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import librosa
+import soundfile as sf
+import torch
+from demucs.audio import AudioFile
+
+from .metrics import span
+from .models import DEMUCS_MODEL, get_demucs
+from .separate import separate_track, select_outputs
+from .drum_transcribe import DrumAnalysis, classify_onsets, parse_groove
+from .midi_events import NoteEvents
+from .transcribe import notes_from_array, write_note_events
+
+# seconds of audio on each side of a chunk that the model sees but whose output is discarded
+CHUNK_CONTEXT = 5.0
+MIN_CHUNK_SECONDS = 20.0
+# rough multiplier over the raw float32 buffers for Demucs' internal activations
+WORKING_SET_FACTOR = 4
+
+
+def audio_duration(path: str) -> float:
+    return AudioFile(path).duration
+
+
+def chunk_seconds(max_memory_mb: float, samplerate: int, channels: int, n_sources: int) -> float:
+    """
+    Longest chunk (core region, without context) whose input, separated sources and the
+    model's working set fit in `max_memory_mb`.
+    """
+    bytes_per_second = samplerate * channels * 4 * (1 + n_sources) * WORKING_SET_FACTOR
+    seconds = max_memory_mb * 1024 * 1024 / bytes_per_second - 2 * CHUNK_CONTEXT
+    return max(MIN_CHUNK_SECONDS, seconds)
+
+
+class Chunk:
+    """`wav` covers [context_start, context_end); only [start, end) belongs to this chunk."""
+
+    def __init__(self, index, start, end, context_start, wav, samplerate):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.context_start = context_start
+        self.wav = wav
+        self.samplerate = samplerate
+
+    def core(self, x):
+        """Slice the owned region out of an array covering the context window (time last)."""
+        a = int(round((self.start - self.context_start) * self.samplerate))
+        b = a + int(round((self.end - self.start) * self.samplerate))
+        return x[..., a:b]
+
+
+def read_window(audio: AudioFile, start: float, end: float, samplerate: int, channels: int,
+                index: int = 0) -> Chunk:
+    """Decode [start, end) of an AudioFile plus up to CHUNK_CONTEXT seconds on either side."""
+    context_start = max(0.0, start - CHUNK_CONTEXT)
+    context_end = min(audio.duration, end + CHUNK_CONTEXT)
+    wav = audio.read(seek_time=context_start, duration=context_end - context_start,
+                     streams=0, samplerate=samplerate, channels=channels)
+    return Chunk(index, start, end, context_start, wav, samplerate)
+
+
+def iter_chunks(path: str, samplerate: int, channels: int, seconds: float) -> Iterator[Chunk]:
+    """Decode `path` one overlapping window at a time through ffmpeg."""
+    audio = AudioFile(path)
+    duration = audio.duration
+    n_chunks = max(1, math.ceil(duration / seconds))
+    for i in range(n_chunks):
+        start = i * seconds
+        yield read_window(audio, start, min(duration, start + seconds), samplerate, channels, index=i)
+
+
+def separate_window(filepath: str, stems: List[str], start: float, end: float,
+                    model_name: str = DEMUCS_MODEL,
+                    options: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, torch.Tensor], int]:
+    """
+    Separate only [start, end) seconds of `filepath`. Demucs sees CHUNK_CONTEXT seconds
+    of context on either side, which is cut off again, so the excerpt's edges sound as
+    they do in a full-song run. Returns (stems, sample rate) like separate_to_memory.
+    """
+    model = get_demucs(model_name)
+    audio = AudioFile(filepath)
+    end = min(end, audio.duration)
+    if not 0 <= start < end:
+        raise ValueError(f"window {start}-{end}s is outside the recording")
+    chunk = read_window(audio, start, end, model.samplerate, model.audio_channels)
+    outputs = select_outputs(separate_track(chunk.wav, model, options), stems)
+    return {name: chunk.core(source) for name, source in outputs.items()}, model.samplerate
+
+
+class StemWriter:
+    """Appends chunk after chunk to one WAV per stem, then transcodes to the download format."""
+
+    def __init__(self, out_dir: str, samplerate: int, channels: int, ext: str = "mp3"):
+        self.out_dir = out_dir
+        self.samplerate = samplerate
+        self.channels = channels
+        self.ext = ext
+        self._files: Dict[str, sf.SoundFile] = {}
+
+    def write(self, name: str, samples: np.ndarray):
+        fh = self._files.get(name)
+        if fh is None:
+            path = os.path.join(self.out_dir, f"{name}.wav")
+            fh = self._files[name] = sf.SoundFile(path, "w", self.samplerate, self.channels, subtype="PCM_16")
+        fh.write(np.clip(samples.T, -1.0, 1.0))
+
+    def close(self) -> List[str]:
+        written = []
+        for name, fh in self._files.items():
+            fh.close()
+            wav_path = os.path.join(self.out_dir, f"{name}.wav")
+            if self.ext == "wav":
+                written.append(wav_path)
+                continue
+            path = os.path.join(self.out_dir, f"{name}.{self.ext}")
+            cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", wav_path]
+            if self.ext == "mp3":
+                cmd += ["-b:a", "320k"]
+            subprocess.run(cmd + [path], check=True)
+            os.remove(wav_path)
+            written.append(path)
+        self._files = {}
+        return written
+
+
+class DrumStream:
+    """Drum onsets and hit types collected chunk by chunk, in absolute seconds."""
+
+    def __init__(self, sensitivity: float):
+        self.sensitivity = sensitivity
+        self.onset_times: List[float] = []
+        self.drum_types: List[int] = []
+        self.tempos: List[float] = []
+
+    def add(self, chunk: Chunk, y: np.ndarray):
+        analysis = DrumAnalysis(y, chunk.samplerate)
+        frames = analysis.onsets(self.sensitivity)
+        types = classify_onsets(analysis.y_normalized, analysis.sr, frames, analysis.hop_length)
+        frames = frames[:len(types)]
+        # onset frames are relative to the trimmed signal, the chunk to its context window
+        times = chunk.context_start + (analysis.trim_index[0] + frames * analysis.hop_length) / analysis.sr
+        own = (times >= chunk.start) & (times < chunk.end)
+        self.onset_times.extend(times[own].tolist())
+        self.drum_types.extend(np.asarray(types)[own].tolist())
+        if len(frames):
+            self.tempos.append(analysis.tempo())
+
+    def tempo(self) -> int:
+        tempo = float(np.median(self.tempos)) if self.tempos else 120
+        return max(20, int(tempo) if not math.isnan(tempo) else 120)
+
+    def save(self, midi_path: str, groove: str = "4/4", quantize: bool = True) -> str:
+        nom, denom = parse_groove(groove)
+        tempo = self.tempo()
+        events = NoteEvents.from_seconds(self.onset_times, self.drum_types, tempo)
+        if quantize:
+            events = events.quantize(subdivision=4)
+        return events.save(midi_path, tempo=tempo, numerator=nom, denominator=denom)
+
+
+class NoteStream:
+    """basic-pitch note events collected chunk by chunk, in absolute seconds."""
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+        self.note_events = []
+
+    def add(self, chunk: Chunk, y: np.ndarray):
+        _, events = notes_from_array(y, chunk.samplerate, model_path=self.model_path)
+        for start, end, pitch, amplitude, bends in events:
+            start += chunk.context_start
+            # a note belongs to the chunk it starts in; the context lets it run past the boundary
+            if chunk.start <= start < chunk.end:
+                self.note_events.append((start, end + chunk.context_start, pitch, amplitude, bends))
+
+    def save(self, midi_path: str) -> str:
+        return write_note_events(self.note_events, midi_path)
+
+
+def stream_song(
+    filepath: str,
+    out_dir: str,
+    stems: List[str],
+    max_memory_mb: float,
+    drum_sensitivity: float,
+    stem_format: str = "mp3",
+    progress: Optional[Callable[..., None]] = None,
+    model_name: str = DEMUCS_MODEL,
+    demucs_options: Optional[Dict[str, Any]] = None,
+    basic_pitch_path=None
+) -> Dict[str, str]:
+    """
+    Bounded-memory variant of separation plus transcription for long recordings.
+    The input is decoded, separated and transcribed one chunk at a time; stems are
+    appended to their files and note/drum events are accumulated, so peak memory
+    depends on the chunk length and not on the song length.
+    `model_name`, `demucs_options` and `basic_pitch_path` come from the job's profile.
+    Returns {stem: midi path}.
+    """
+    model = get_demucs(model_name)
+    seconds = chunk_seconds(max_memory_mb, model.samplerate, model.audio_channels, len(model.sources))
+    n_chunks = max(1, math.ceil(audio_duration(filepath) / seconds))
+
+    writer = StemWriter(out_dir, model.samplerate, model.audio_channels, stem_format)
+    streams = {s: DrumStream(drum_sensitivity) if s == "drums" else NoteStream(basic_pitch_path) for s in stems}
+
+    for chunk in iter_chunks(filepath, model.samplerate, model.audio_channels, seconds):
+        if progress:
+            progress("separating", f"chunk {chunk.index + 1}/{n_chunks}")
+        with span("chunk", audio_seconds=chunk.end - chunk.start, index=chunk.index):
+            outputs = select_outputs(separate_track(chunk.wav, model, demucs_options), stems)
+            for name, source in outputs.items():
+                writer.write(name, chunk.core(source.cpu().numpy()))
+            for s, stream in streams.items():
+                if s in outputs:
+                    stream.add(chunk, librosa.to_mono(outputs[s].cpu().numpy()))
+        del outputs, chunk
+
+    with span("encode", format=stem_format):
+        writer.close()
+
+    midi_paths = {}
+    for s, stream in streams.items():
+        if progress:
+            progress("transcribing", s)
+        if s == "drums":
+            midi_paths[s] = stream.save(os.path.join(out_dir, "drums.mid"))
+        else:
+            midi_paths[s] = stream.save(os.path.join(out_dir, f"{s}_basic_pitch.mid"))
+    return midi_paths
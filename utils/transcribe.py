@@ -1,20 +1,95 @@
 import os
-from basic_pitch.inference import predict_and_save
-from basic_pitch import ICASSP_2022_MODEL_PATH
+import numpy as np
+import librosa
+from basic_pitch.constants import AUDIO_SAMPLE_RATE, AUDIO_N_SAMPLES, FFT_HOP
+from basic_pitch.inference import predict, window_audio_file, unwrap_output
+import basic_pitch.note_creation as infer
+from .metrics import span
+from .models import get_basic_pitch
 
-def transcribe_to_midi(audio_path):
+# basic-pitch's own predict() defaults
+ONSET_THRESHOLD = 0.5
+FRAME_THRESHOLD = 0.3
+MINIMUM_NOTE_LENGTH = 127.70  # ms
+N_OVERLAPPING_FRAMES = 30
+
+def transcribe_to_midi(audio_path, posteriors_path=None, model_path=None):
     output_dir = os.path.dirname(audio_path)
     base_name = os.path.splitext(os.path.basename(audio_path))[0]
     midi_path = os.path.join(output_dir, f"{base_name}_basic_pitch.mid")
 
-    predict_and_save(
-        [audio_path],
-        output_directory=output_dir,
-        model_or_model_path=ICASSP_2022_MODEL_PATH,
-        sonify_midi=False,
-        save_midi=True,
-        save_model_outputs=False,
-        save_notes=False
-    )
+    # reuse the process-wide model instead of rebuilding it from ICASSP_2022_MODEL_PATH per stem
+    with span("basic_pitch", file=os.path.basename(audio_path)):
+        model_output, midi_data, _ = predict(audio_path, get_basic_pitch(model_path))
+    midi_data.write(midi_path)
+    if posteriors_path:
+        save_posteriors(posteriors_path, model_output)
+
+    return midi_path
+
+def save_posteriors(path, model_output):
+    """Keep basic-pitch's note/onset/contour posteriors so notes can be re-derived without the model."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        np.savez_compressed(fh, **{k: np.asarray(v, dtype=np.float32) for k, v in model_output.items()})
+    return path
+
+def load_posteriors(path):
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+def run_inference_array(y, sr, model):
+    """
+    basic_pitch.inference.run_inference for mono audio that is already in memory,
+    so separated stems do not have to be encoded and decoded again.
+    """
+    y = np.asarray(y, dtype=np.float32)
+    if sr != AUDIO_SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=AUDIO_SAMPLE_RATE)
+
+    overlap_len = N_OVERLAPPING_FRAMES * FFT_HOP
+    hop_size = AUDIO_N_SAMPLES - overlap_len
+    original_length = y.shape[0]
+    y = np.concatenate([np.zeros((overlap_len // 2,), dtype=np.float32), y])
+
+    output = {"note": [], "onset": [], "contour": []}
+    with span("basic_pitch.inference", audio_seconds=original_length / AUDIO_SAMPLE_RATE):
+        for window, _ in window_audio_file(y, hop_size):
+            for k, v in model.predict(np.expand_dims(window, axis=0)).items():
+                output[k].append(v)
+    return {k: unwrap_output(np.concatenate(output[k]), original_length, N_OVERLAPPING_FRAMES) for k in output}
+
+def notes_from_posteriors(model_output, onset_threshold=ONSET_THRESHOLD, frame_threshold=FRAME_THRESHOLD,
+                          minimum_note_length=MINIMUM_NOTE_LENGTH, melodia_trick=True):
+    """
+    Note decoding only, from basic-pitch posteriors.
+    Returns the PrettyMIDI object and basic-pitch's note events
+    (start_s, end_s, pitch, amplitude, pitch_bends).
+    """
+    min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+    with span("basic_pitch.notes"):
+        return infer.model_output_to_notes(
+            model_output,
+            onset_thresh=onset_threshold,
+            frame_thresh=frame_threshold,
+            min_note_len=min_note_len,
+            melodia_trick=melodia_trick
+        )
+
+def notes_from_array(y, sr, posteriors_path=None, model_path=None):
+    """Transcribe mono audio samples at rate `sr`; returns what notes_from_posteriors does."""
+    model_output = run_inference_array(y, sr, get_basic_pitch(model_path))
+    if posteriors_path:
+        save_posteriors(posteriors_path, model_output)
+    return notes_from_posteriors(model_output)
+
+def transcribe_array(y, sr, midi_path, posteriors_path=None, model_path=None):
+    """Transcribe mono audio samples at rate `sr` and write the MIDI to `midi_path`."""
+    midi_data, _ = notes_from_array(y, sr, posteriors_path, model_path)
+    midi_data.write(midi_path)
+    return midi_path
 
+def write_note_events(note_events, midi_path):
+    """Write basic-pitch note events, e.g. collected chunk by chunk, as one MIDI file."""
+    infer.note_events_to_midi(note_events).write(midi_path)
     return midi_path
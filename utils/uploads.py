@@ -0,0 +1,67 @@
+import hashlib
+import os
+import shutil
+import uuid
+from typing import List, Optional
+
+from flask import Request, current_app
+from werkzeug.utils import secure_filename
+
+
+class HashingUpload:
+    """
+    Where the form parser writes an uploaded file: straight into its own folder
+    below UPLOAD_FOLDER, with the sha256 of the bytes computed as they arrive,
+    so the upload is neither copied from a temporary file nor read again to
+    hash it. Whoever takes the file over sets `claimed`; unclaimed uploads are
+    removed when the request ends.
+    """
+
+    def __init__(self, upload_folder: str, filename: Optional[str]):
+        self.upload_dir = os.path.join(upload_folder, uuid.uuid4().hex)
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.path = os.path.join(self.upload_dir, secure_filename(filename or "") or "upload")
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.claimed = False
+        self._fh = open(self.path, "w+b")
+
+    def write(self, data) -> int:
+        self.hasher.update(data)
+        self.size += len(data)
+        return self._fh.write(data)
+
+    def close(self):
+        self._fh.close()
+
+    def discard(self):
+        self.close()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush for FileStorage
+        return getattr(self._fh, name)
+
+    def __iter__(self):
+        return iter(self._fh)
+
+
+class UploadRequest(Request):
+    """Request whose file parts are HashingUploads (see app.request_class)."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = HashingUpload(current_app.config["UPLOAD_FOLDER"], filename)
+        self.uploads.append(upload)
+        return upload
+
+    @property
+    def uploads(self) -> List[HashingUpload]:
+        uploads = self.__dict__.get("_uploads")
+        if uploads is None:
+            uploads = self.__dict__["_uploads"] = []
+        return uploads
+
+    def discard_unclaimed(self):
+        for upload in self.uploads:
+            if not upload.claimed:
+                upload.discard()